@@ -0,0 +1,237 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure parsing, matching and test processing on synthetic rules.
+
+For each size, generates a rules file mixing Redirect and RedirectMatch
+rules, 410s and redirect chains, and a test file with one test per
+rule, then reports:
+
+  parse_s          time for parser.parse_rules() over the rules file
+  load_s           time to create the rules and add them to a RuleSet
+  compile_s        time to build the combined regex engines
+  hit_us, miss_us  latency of RuleSet.match() for paths that match a
+                   rule and paths that do not, as mean, p50 and p99
+  tests_per_s      throughput of app.process_tests() over every test
+
+The generated files depend only on the size and the seed, so results
+from different versions of whereto can be compared. Use --output to
+save the results as JSON and --compare to show the change from a
+saved file.
+
+Run with: python tools/benchmark.py [--sizes 1000,10000] [--output FILE]
+"""
+
+import argparse
+import gc
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+from whereto import app
+from whereto import parser
+from whereto import rules
+
+
+SAMPLES = 2000
+
+
+def generate(size, seed=0):
+    """Return the text of a rules file and a test file with size rules.
+
+    About 55% of the rules are Redirect, 30% RedirectMatch with a
+    prefix, 5% RedirectMatch without one, 5% 410 and 5% Redirect
+    rules pointing at the path of another Redirect, making chains.
+
+    """
+    rng = random.Random(seed)
+    sections = ['section{}'.format(i) for i in range(max(1, size // 200))]
+    rule_lines = []
+    test_lines = []
+    redirect_paths = []
+    for i in range(size):
+        section = rng.choice(sections)
+        kind = rng.random()
+        if kind < 0.55:
+            path = '/{}/page{}.html'.format(section, i)
+            target = '/new/{}/page{}.html'.format(section, i)
+            rule_lines.append('Redirect 301 {} {}'.format(path, target))
+            test_lines.append('{} 301 {}'.format(path, target))
+            redirect_paths.append(path)
+        elif kind < 0.85:
+            rule_lines.append(
+                'RedirectMatch 301 ^/{0}/dir{1}/(.*)$ /{0}/new{1}/$1'.format(
+                    section, i))
+            test_lines.append(
+                '/{0}/dir{1}/x.html 301 /{0}/new{1}/x.html'.format(
+                    section, i))
+        elif kind < 0.90:
+            rule_lines.append(
+                'RedirectMatch 302 /legacy{0}/(.*)\\.php$ '
+                '/modern{0}/$1'.format(i))
+            test_lines.append(
+                '/a/legacy{0}/b.php 302 /a/modern{0}/b'.format(i))
+        elif kind < 0.95:
+            path = '/{}/gone{}.html'.format(section, i)
+            rule_lines.append('Redirect 410 {}'.format(path))
+            test_lines.append('{} 410'.format(path))
+        else:
+            path = '/{}/moved{}.html'.format(section, i)
+            if redirect_paths:
+                target = rng.choice(redirect_paths)
+            else:
+                target = '/new/{}/moved{}.html'.format(section, i)
+            rule_lines.append('Redirect 301 {} {}'.format(path, target))
+            test_lines.append('{} 301 {}'.format(path, target))
+    return ('\n'.join(rule_lines) + '\n', '\n'.join(test_lines) + '\n')
+
+
+def _latency(ruleset, paths):
+    times = []
+    # Like timeit, keep garbage collection pauses out of the numbers.
+    gc.disable()
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            ruleset.match(path)
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    times.sort()
+    return {
+        'mean': round(statistics.mean(times) * 1e6, 2),
+        'p50': round(times[len(times) // 2] * 1e6, 2),
+        'p99': round(times[len(times) * 99 // 100] * 1e6, 2),
+    }
+
+
+def run(size, seed=0):
+    """Run every measurement for one size and return the results."""
+    rules_text, tests_text = generate(size, seed)
+    result = {'rules': size}
+
+    start = time.perf_counter()
+    parsed = list(parser.parse_rules(io.StringIO(rules_text)))
+    result['parse_s'] = round(time.perf_counter() - start, 4)
+
+    start = time.perf_counter()
+    ruleset = rules.RuleSet()
+    for linenum, params in parsed:
+        ruleset.add(linenum, *params)
+    result['load_s'] = round(time.perf_counter() - start, 4)
+
+    start = time.perf_counter()
+    ruleset.compile()
+    result['compile_s'] = round(time.perf_counter() - start, 4)
+
+    tests = [
+        (linenum,) + tuple(params)
+        for linenum, params in parser.parse_tests(io.StringIO(tests_text))
+    ]
+    rng = random.Random(seed)
+    hits = [t[1] for t in rng.choices(tests, k=SAMPLES)]
+    misses = [
+        '/section{}/missing{}.html'.format(rng.randrange(size), i)
+        for i in range(SAMPLES)
+    ]
+    result['hit_us'] = _latency(ruleset, hits)
+    result['miss_us'] = _latency(ruleset, misses)
+
+    start = time.perf_counter()
+    mismatches, cycles, too_many_hops, untested = app.process_tests(
+        ruleset, tests, 0)
+    elapsed = time.perf_counter() - start
+    if mismatches or cycles:
+        raise RuntimeError('generated tests failed: {} {}'.format(
+            mismatches[:3], cycles[:3]))
+    result['tests_per_s'] = round(len(tests) / elapsed)
+    return result
+
+
+def _flatten(result):
+    for key, value in result.items():
+        if isinstance(value, dict):
+            for subkey, subvalue in value.items():
+                yield ('{}.{}'.format(key, subkey), subvalue)
+        else:
+            yield (key, value)
+
+
+def show(result, baseline=None):
+    old = dict(_flatten(baseline)) if baseline else {}
+    print('{} rules'.format(result['rules']))
+    for key, value in _flatten(result):
+        if key == 'rules':
+            continue
+        line = '  {:<16} {:>12}'.format(key, value)
+        if old.get(key):
+            line += '  {:+.1f}%'.format((value - old[key]) / old[key] * 100)
+        print(line)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+    )
+    argument_parser.add_argument(
+        '--sizes',
+        default='1000,10000,100000',
+        help='comma-separated numbers of rules to generate',
+    )
+    argument_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='seed for the generated rules and paths',
+    )
+    argument_parser.add_argument(
+        '-o', '--output',
+        metavar='FILE',
+        help='write the results to a JSON file',
+    )
+    argument_parser.add_argument(
+        '--compare',
+        metavar='FILE',
+        help='show the change from results saved with --output',
+    )
+    args = argument_parser.parse_args()
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            for result in json.load(f)['results']:
+                baselines[result['rules']] = result
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = run(size, args.seed)
+        results.append(result)
+        show(result, baselines.get(size))
+        sys.stdout.flush()
+
+    if args.output:
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
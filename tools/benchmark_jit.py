@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare matching with and without PCRE2 JIT compilation.
+
+Loads the synthetic rules from benchmark.py, or a rules file and the
+paths of a test file, once with JIT compilation and once with the
+interpreter, and reports for each:
+
+  compile_s     time to compile every pattern and build the regex
+                engines
+  hit_per_s     lookups per second for paths that match a rule
+  miss_per_s    lookups per second for paths that match no rule
+
+Run with: python tools/benchmark_jit.py [--size 10000]
+          python tools/benchmark_jit.py htaccess_file test_file
+"""
+
+import argparse
+import io
+import random
+import time
+
+import benchmark
+
+from whereto import parser
+from whereto import rules
+
+
+SAMPLES = 5000
+
+
+def _throughput(ruleset, paths):
+    start = time.perf_counter()
+    for path in paths:
+        ruleset.match(path)
+    return round(len(paths) / (time.perf_counter() - start))
+
+
+def run(rules_text, hits, misses, jit):
+    parsed = list(parser.parse_rules(io.StringIO(rules_text)))
+    ruleset = rules.RuleSet(lazy=True, jit=jit)
+    for linenum, params in parsed:
+        ruleset.add(linenum, *params)
+    start = time.perf_counter()
+    ruleset.precompile()
+    ruleset.compile()
+    result = {'compile_s': round(time.perf_counter() - start, 3)}
+    result['hit_per_s'] = _throughput(ruleset, hits)
+    result['miss_per_s'] = _throughput(ruleset, misses)
+    return result
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+    )
+    argument_parser.add_argument(
+        '--size',
+        type=int,
+        default=10000,
+        help='number of synthetic rules to generate',
+    )
+    argument_parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='seed for the generated rules and paths',
+    )
+    argument_parser.add_argument(
+        'htaccess_file',
+        nargs='?',
+        help='use the rules in this file instead of synthetic rules',
+    )
+    argument_parser.add_argument(
+        'test_file',
+        nargs='?',
+        help='file with the test paths to look up, with htaccess_file',
+    )
+    args = argument_parser.parse_args()
+    if args.htaccess_file and not args.test_file:
+        argument_parser.error('a test file is required with a rules file')
+
+    if args.htaccess_file:
+        with open(args.htaccess_file, encoding='utf-8') as f:
+            rules_text = f.read()
+        with open(args.test_file, encoding='utf-8') as f:
+            tests = [params for linenum, params in parser.parse_tests(f)]
+    else:
+        rules_text, tests_text = benchmark.generate(args.size, args.seed)
+        tests = [
+            params
+            for linenum, params in parser.parse_tests(
+                io.StringIO(tests_text))
+        ]
+    rng = random.Random(args.seed)
+    hits = [t[0] for t in rng.choices(tests, k=SAMPLES)]
+    misses = [
+        '/section{}/missing{}.html'.format(rng.randrange(1000), i)
+        for i in range(SAMPLES)
+    ]
+
+    results = {}
+    for name, jit in (('interpreter', False), ('jit', True)):
+        results[name] = run(rules_text, hits, misses, jit)
+    print('{:<12} {:>12} {:>12}  {}'.format(
+        '', 'interpreter', 'jit', 'change'))
+    for key in ('compile_s', 'hit_per_s', 'miss_per_s'):
+        old = results['interpreter'][key]
+        new = results['jit'][key]
+        print('{:<12} {:>12} {:>12}  {:+.1f}%'.format(
+            key, old, new, (new - old) / old * 100 if old else 0.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure the memory used by a loaded RuleSet.
+
+Loads the synthetic rules from benchmark.py, or a rules file, and
+reports the memory held by Python after parsing the rules into a
+RuleSet and after building its regex engines, as measured by
+tracemalloc. Memory allocated by PCRE2 for the compiled patterns is
+not included.
+
+Run with: python tools/benchmark_memory.py [--sizes 100000] [htaccess_file]
+"""
+
+import argparse
+import gc
+import io
+import tracemalloc
+
+import benchmark
+
+from whereto import parser
+from whereto import rules
+
+
+def measure(text):
+    gc.collect()
+    tracemalloc.start()
+    ruleset = rules.RuleSet()
+    for linenum, params in parser.parse_rules(io.StringIO(text)):
+        ruleset.add(linenum, *params)
+    gc.collect()
+    loaded = tracemalloc.get_traced_memory()[0]
+    ruleset.compile()
+    gc.collect()
+    compiled = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (ruleset, loaded, compiled)
+
+
+def show(name, text):
+    ruleset, loaded, compiled = measure(text)
+    count = len(ruleset.all_ids)
+    print('{}: {} rules'.format(name, count))
+    print('  loaded   {:>8.1f} MiB {:>6.0f} bytes/rule'.format(
+        loaded / 2 ** 20, loaded / count))
+    print('  compiled {:>8.1f} MiB {:>6.0f} bytes/rule'.format(
+        compiled / 2 ** 20, compiled / count))
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+    )
+    argument_parser.add_argument(
+        '--sizes',
+        default='100000',
+        help='comma-separated numbers of synthetic rules to generate',
+    )
+    argument_parser.add_argument(
+        'htaccess_file',
+        nargs='?',
+        help='measure this rules file instead of synthetic rules',
+    )
+    args = argument_parser.parse_args()
+    if args.htaccess_file:
+        with open(args.htaccess_file, encoding='utf-8') as f:
+            show(args.htaccess_file, f.read())
+        return
+    for size in (int(s) for s in args.sizes.split(',')):
+        rules_text, tests_text = benchmark.generate(size)
+        show('synthetic', rules_text)
+
+
+if __name__ == '__main__':
+    main()
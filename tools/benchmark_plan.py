@@ -0,0 +1,137 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare lookups with and without RuleSet.optimize().
+
+Builds a synthetic rules file with a few unanchored rules at the end
+and traffic where a small number of rules get most of the requests,
+then counts the rules evaluated and the combined pattern searches run
+for each lookup.
+
+Run with: python tools/benchmark_plan.py
+"""
+
+import collections
+import random
+import time
+
+from whereto import rules
+
+
+RULES = 10000
+REQUESTS = 50000
+
+
+def build_rules():
+    ruleset = rules.RuleSet()
+    linenum = 0
+    for i in range(RULES):
+        linenum += 1
+        if i % 2:
+            ruleset.add(linenum, 'redirect', '301',
+                        '/p{}/index.html'.format(i),
+                        '/q{}/index.html'.format(i))
+        else:
+            ruleset.add(linenum, 'redirectmatch', '301',
+                        '^/r{}/(.*)$'.format(i), '/s{}/$1'.format(i))
+    for pattern in ('/legacy/', '\\.php$', '/old-'):
+        linenum += 1
+        ruleset.add(linenum, 'redirectmatch', '301', pattern, '/')
+    return ruleset
+
+
+def requests(ruleset, count, seed):
+    # A Zipf-like distribution over the rules, plus some misses.
+    rng = random.Random(seed)
+    ruleset_rules = list(ruleset)[:RULES]
+    rng.shuffle(ruleset_rules)
+    weights = [1.0 / (rank + 1) for rank in range(len(ruleset_rules))]
+    paths = []
+    for rule in rng.choices(ruleset_rules, weights, k=count):
+        if isinstance(rule, rules.Redirect):
+            paths.append(rule.pattern)
+        else:
+            paths.append(rule.prefix + 'page.html')
+    for i in range(count // 20):
+        paths[rng.randrange(count)] = '/missing/{}'.format(i)
+    return paths
+
+
+class Counter:
+
+    def __init__(self):
+        self.evaluated = 0
+        self.searches = 0
+
+    def install(self):
+        evaluate = rules.RuleSet._evaluate
+        search = rules.PatternSet.search
+
+        def counting_evaluate(ruleset, rule, path):
+            self.evaluated += 1
+            return evaluate(ruleset, rule, path)
+
+        def counting_search(patterns, path):
+            self.searches += 1
+            return search(patterns, path)
+
+        rules.RuleSet._evaluate = counting_evaluate
+        rules.PatternSet.search = counting_search
+
+        def uninstall():
+            rules.RuleSet._evaluate = evaluate
+            rules.PatternSet.search = search
+
+        return uninstall
+
+
+def measure(name, ruleset, paths):
+    ruleset.match_many(paths)  # build the engines
+    counter = Counter()
+    uninstall = counter.install()
+    try:
+        for path in paths:
+            ruleset.match(path)
+    finally:
+        uninstall()
+    start = time.perf_counter()
+    for path in paths:
+        ruleset.match(path)
+    elapsed = time.perf_counter() - start
+    print('{:<10} {:>10.2f} rules {:>10.2f} searches {:>8.2f} us'.format(
+        name,
+        counter.evaluated / len(paths),
+        counter.searches / len(paths),
+        elapsed / len(paths) * 1e6,
+    ))
+    return [ruleset.match(p) for p in paths]
+
+
+def main():
+    ruleset = build_rules()
+    # Learn the hit counts from one day of traffic and replay another.
+    hits = collections.Counter()
+    for result in ruleset.match_many(requests(ruleset, REQUESTS, 1)):
+        if result is not None:
+            hits[result[0]] += 1
+    paths = requests(ruleset, REQUESTS, 2)
+
+    print('{} rules, {} requests, per lookup:'.format(
+        len(ruleset.all_ids), len(paths)))
+    before = measure('file order', ruleset, paths)
+    ruleset.optimize(hits)
+    after = measure('optimized', ruleset, paths)
+    assert before == after, 'optimized results differ'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare parser.split_line() with shlex.split().
+
+Run with: python tools/benchmark_tokenizer.py
+"""
+
+import shlex
+import timeit
+
+from whereto import parser
+
+
+LINES = {
+    'plain redirect': 'redirect 301 /nova/latest/a.html /nova/pike/a.html',
+    'plain test': '/nova/latest/a.html 301 /nova/pike/a.html',
+    'quoted pattern': (
+        'redirectmatch 301 "^/nova/latest/(.*)$" /nova/pike/$1'
+    ),
+    'escaped target': (
+        "redirectmatch 301 '^/user/(.*)$' /pike/user/\\$1"
+    ),
+}
+
+
+def main():
+    number = 20000
+    print('{:<16} {:>10} {:>10} {:>8}'.format(
+        'line', 'shlex us', 'split us', 'speedup'))
+    for name, line in LINES.items():
+        assert shlex.split(line) == parser.split_line(line)
+        slow = timeit.timeit(
+            lambda: shlex.split(line), number=number) / number
+        fast = timeit.timeit(
+            lambda: parser.split_line(line), number=number) / number
+        print('{:<16} {:>10.2f} {:>10.2f} {:>7.1f}x'.format(
+            name, slow * 1e6, fast * 1e6, slow / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure redirect server throughput and latency.
+
+Requests the input path of every test in a test file, cycling through
+them until the requested number of requests have been made. Without
+--url the rules are loaded and the WSGI application is called
+directly, which measures the cost of the rules lookup alone. With
+--url the requests go over HTTP to a running whereto-serve.
+
+Run with: python tools/loadtest.py [--url URL] htaccess_file test_file
+"""
+
+import argparse
+import concurrent.futures
+import http.client
+import itertools
+import statistics
+import threading
+import time
+import urllib.parse
+
+from whereto import loader
+from whereto import parser
+from whereto import server
+
+
+def _read_paths(filename):
+    with open(filename, encoding='utf-8') as f:
+        return [params[0] for linenum, params in parser.parse_tests(f)]
+
+
+def _wsgi_requester(application):
+    def start_response(status, headers):
+        pass
+
+    def request(path):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': '',
+        }
+        for chunk in application(environ, start_response):
+            pass
+
+    return request
+
+
+def _http_requester(url):
+    parts = urllib.parse.urlsplit(url)
+    local = threading.local()
+
+    def request(path):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection(
+                parts.hostname, parts.port or 80)
+        conn.request('GET', urllib.parse.quote(path))
+        conn.getresponse().read()
+
+    return request
+
+
+def _rotate(paths, offset):
+    offset %= len(paths)
+    return paths[offset:] + paths[:offset]
+
+
+def _run(request, paths, count):
+    latencies = []
+    for path in itertools.islice(itertools.cycle(paths), count):
+        start = time.perf_counter()
+        request(path)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+    )
+    argument_parser.add_argument(
+        '--url',
+        help='URL of a running server, instead of calling the '
+        'application in this process',
+    )
+    argument_parser.add_argument(
+        '-n', '--requests',
+        type=int,
+        default=10000,
+        help='how many requests to make',
+    )
+    argument_parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        default=1,
+        help='how many requests to make at the same time',
+    )
+    argument_parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=0,
+        help='match cache size for the in-process application',
+    )
+    argument_parser.add_argument('htaccess_file')
+    argument_parser.add_argument('test_file')
+    args = argument_parser.parse_args()
+
+    paths = _read_paths(args.test_file)
+    if not paths:
+        argument_parser.error('no tests in {}'.format(args.test_file))
+    if args.url:
+        request = _http_requester(args.url)
+    else:
+        ruleset = loader.load_ruleset(
+            args.htaccess_file, cache_size=args.cache_size)
+        request = _wsgi_requester(server.WSGIApplication(ruleset))
+        # Build the lazily compiled indexes before timing anything.
+        for path in paths:
+            request(path)
+
+    per_worker = args.requests // args.concurrency
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        # Start each worker at a different place in the list of paths.
+        futures = [
+            pool.submit(_run, request, _rotate(paths, i), per_worker)
+            for i in range(args.concurrency)
+        ]
+        latencies = [t for f in futures for t in f.result()]
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print('requests:    {}'.format(len(latencies)))
+    print('concurrency: {}'.format(args.concurrency))
+    print('elapsed:     {:.3f} s'.format(elapsed))
+    print('throughput:  {:.0f} req/s'.format(len(latencies) / elapsed))
+    print('mean:        {:.1f} us'.format(
+        statistics.mean(latencies) * 1e6))
+    for pct in (50, 90, 99):
+        index = min(len(latencies) - 1, len(latencies) * pct // 100)
+        print('p{}:         {:.1f} us'.format(pct, latencies[index] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
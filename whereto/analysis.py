@@ -0,0 +1,280 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import re
+
+from whereto import rules
+
+
+LOG = logging.getLogger()
+
+
+def rule_target(rule):
+    """Return the path a rule always redirects to, or None.
+
+    Redirect rules always produce their target. RedirectMatch rules
+    only do if the pattern matches the whole path and the target does
+    not refer to any groups. Rules without a target, like 410, and
+    rules whose pattern cannot be compiled also return None.
+
+    """
+    if rule.target is None:
+        return None
+    if isinstance(rule, rules.Redirect):
+        return rule.target
+    if not rule.anchored or not rule.pattern.endswith('$'):
+        # The part of the path after the match is kept.
+        return None
+    if rule.pattern.endswith('\\$'):
+        return None
+    try:
+        # Lazily compiled rules compile their pattern here.
+        parts = rule.target_parts
+    except Exception as e:
+        LOG.warning('Failed to compile %s: %s', rule, e)
+        return None
+    if parts is None or not all(isinstance(p, str) for p in parts):
+        return None
+    return ''.join(parts)
+
+
+def build_graph(ruleset):
+    """Return a dict mapping rule line numbers to the next rule matched.
+
+    The value is the line number of the rule that matches the target
+    of the key rule, or None if the target is not known or no rule
+    matches it.
+
+    """
+    graph = {}
+    for rule in ruleset:
+        target = rule_target(rule)
+        match = None if target is None else ruleset.match(target)
+        graph[rule.linenum] = None if match is None else match[0]
+    return graph
+
+
+def find_chains(graph, max_hops):
+    """Find the redirect cycles and long chains in the rule graph.
+
+    Returns a tuple with a list of cycles and a list of chains. Each
+    cycle is a list of rule line numbers, starting with the first one
+    found, and is reported once. Each chain is a list of rule line
+    numbers starting with a rule that no other rule redirects to and
+    with more than max_hops rules. Chains are not reported if
+    max_hops is 0.
+
+    """
+    cycles = []
+    # The number of rules in the chain starting at each rule, or None
+    # for rules in or leading to a cycle.
+    lengths = {}
+    for start in graph:
+        if start in lengths:
+            continue
+        # Follow the chain until reaching a rule already measured or
+        # one seen during this walk, which means a new cycle.
+        path = []
+        on_path = {}
+        node = start
+        while node is not None and node not in lengths:
+            if node in on_path:
+                cycle = path[on_path[node]:]
+                cycles.append(cycle)
+                for linenum in path:
+                    lengths[linenum] = None
+                break
+            on_path[node] = len(path)
+            path.append(node)
+            node = graph[node]
+        else:
+            length = 0 if node is None else lengths[node]
+            for linenum in reversed(path):
+                if length is not None:
+                    length += 1
+                lengths[linenum] = length
+    chains = []
+    if max_hops:
+        targets = {n for n in graph.values() if n is not None}
+        for start in graph:
+            if start in targets:
+                continue
+            length = lengths[start]
+            if length is None or length <= max_hops:
+                continue
+            chain = []
+            node = start
+            while node is not None:
+                chain.append(node)
+                node = graph[node]
+            chains.append(chain)
+    return (cycles, chains)
+
+
+def find_unreachable(ruleset):
+    """Find rules that can never be the first rule to match a path.
+
+    Returns a list of tuples containing the line number of the
+    unreachable rule, the line number of the earlier rule that always
+    matches first, and a reason, either 'duplicate' when both rules
+    have the same type and pattern, or 'shadowed' when a Redirect
+    pattern is matched by an earlier rule of another kind.
+
+    """
+    unreachable = []
+    first_by_pattern = {}
+    for rule in ruleset:
+        key = (type(rule), rule.pattern)
+        earlier = first_by_pattern.setdefault(key, rule.linenum)
+        if earlier != rule.linenum:
+            unreachable.append((rule.linenum, earlier, 'duplicate'))
+            continue
+        if not isinstance(rule, rules.Redirect):
+            continue
+        # The path a Redirect rule matches is its pattern, so the
+        # first rule matching the pattern is the one that wins.
+        match = ruleset.match(rule.pattern)
+        if match is not None and match[0] != rule.linenum:
+            unreachable.append((rule.linenum, match[0], 'shadowed'))
+    return unreachable
+
+
+# A quantifier, possibly lazy or possessive.
+_quantifier = re.compile(
+    r'(?:([*+?])|\{([0-9]*)(,?)([0-9]*)\})([+?]?)'
+)
+
+# A group that may be repeated. Patterns without one are not scanned.
+_repeated_group = re.compile(r'\)(?:[*+]|\{[0-9]*,?[0-9]*\})')
+
+
+def _quantifier_at(pattern, pos):
+    """Return (repeats, unbounded, end) for the quantifier at pos.
+
+    repeats tells whether the item before pos can match more than once
+    and unbounded whether there is no upper limit to the repetitions.
+    Possessive quantifiers never backtrack, so they count as neither.
+    Without a quantifier, both are False and end is pos.
+
+    """
+    m = _quantifier.match(pattern, pos)
+    if m is None:
+        return (False, False, pos)
+    symbol, low, comma, high, mode = m.groups()
+    if symbol is None and not (low or high):
+        # A brace that is not a quantifier matches itself.
+        return (False, False, pos)
+    if mode == '+':
+        return (False, False, m.end())
+    if symbol:
+        return (symbol != '?', symbol != '?', m.end())
+    if not comma:
+        return (int(low) > 1, False, m.end())
+    if not high:
+        return (True, True, m.end())
+    return (int(high) > 1, False, m.end())
+
+
+def _skip_class(pattern, pos):
+    """Return the position after the character class starting at pos."""
+    pos += 1
+    if pattern.startswith('^', pos):
+        pos += 1
+    if pattern.startswith(']', pos):
+        pos += 1
+    while pos < len(pattern):
+        c = pattern[pos]
+        if c == '\\':
+            pos += 2
+        elif c == '[' and pattern.startswith('[:', pos):
+            end = pattern.find(':]', pos + 2)
+            pos = pos + 1 if end == -1 else end + 2
+        elif c == ']':
+            return pos + 1
+        else:
+            pos += 1
+    return pos
+
+
+def nested_quantifier(pattern):
+    """Return the first repeated group with a repeated item inside.
+
+    Patterns like (a+)+ or (?:x*y?)* can match the same text in many
+    ways, so a path that almost matches makes PCRE2 try all of them,
+    which can take exponential time. Atomic groups and possessive
+    quantifiers do not backtrack and are not reported.
+
+    Returns the text of the group with its quantifier, or None.
+
+    """
+    if not _repeated_group.search(pattern):
+        return None
+    # For each open group: where it starts, whether something inside
+    # it repeats without limit, and whether it is atomic.
+    stack = [[0, False, False]]
+    pos = 0
+    length = len(pattern)
+    while pos < length:
+        c = pattern[pos]
+        if c == '\\':
+            if pattern.startswith('\\Q', pos):
+                end = pattern.find('\\E', pos + 2)
+                pos = length if end == -1 else end + 2
+                continue
+            pos += 2
+        elif c == '[':
+            pos = _skip_class(pattern, pos)
+        elif c == '(':
+            if pattern.startswith('(*', pos) or pattern.startswith(
+                    '(?#', pos):
+                # Verbs and comments do not match anything.
+                end = pattern.find(')', pos)
+                pos = length if end == -1 else end + 1
+                continue
+            atomic = pattern.startswith('(?>', pos)
+            stack.append([pos, False, atomic])
+            pos += 1
+            continue
+        elif c == ')' and len(stack) > 1:
+            start, inner, atomic = stack.pop()
+            repeats, unbounded, end = _quantifier_at(pattern, pos + 1)
+            if inner and repeats and not atomic:
+                return pattern[start:end]
+            if (inner and not atomic) or unbounded:
+                stack[-1][1] = True
+            pos = end
+            continue
+        else:
+            pos += 1
+        repeats, unbounded, end = _quantifier_at(pattern, pos)
+        if unbounded:
+            stack[-1][1] = True
+        pos = end
+    return None
+
+
+def find_nested_quantifiers(ruleset):
+    """Find RedirectMatch rules whose patterns may backtrack badly.
+
+    Returns a list of tuples containing the line number of the rule and
+    the part of its pattern found by nested_quantifier().
+
+    """
+    found = []
+    for rule in ruleset:
+        if not isinstance(rule, rules.RedirectMatch):
+            continue
+        group = nested_quantifier(rule.pattern)
+        if group is not None:
+            found.append((rule.linenum, group))
+    return found
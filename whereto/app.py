@@ -14,14 +14,22 @@
 # under the License.
 
 import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
 import logging
 import sys
 
+from whereto import analysis
+from whereto import chains
+from whereto import incremental
+from whereto import loader
 from whereto import parser
-from whereto import rules
+from whereto import profiler
 
 
-def _find_matches(ruleset, test):
+def _find_matches(resolver, test):
     try:
         linenum, input, code, expected = test
     except ValueError as e:
@@ -33,59 +41,32 @@ def _find_matches(ruleset, test):
             )
         raise RuntimeError('Unable to process test {}: {}'.format(
             test, e))
-    seen = set()
-    matches = []
-    match = ruleset.match(input)
-    while match is not None and len(matches) < 5:
-        matches.append(match)
-        if match[0] in seen:
-            # cycle, stop
-            break
-        seen.add(match[0])
-        if match[-1] is None:
-            # a redirect that doesn't point to a path, like a 410
-            break
-        # Look again in case we have multiple matches and a cycle.
-        match = ruleset.match(match[-1])
-    return matches
-
-
-def process_tests(ruleset, tests, max_hops):
-    """Run the tests against the ruleset and return the results.
+    return resolver.resolve(input)
 
-    The return value is a tuple containing a list of tuples with the
-    inputs that did not match the expected value, a list of tuples
-    with inputs and rules the result in redirect cycles, and a set
-    containing the line numbers of the rules that never matched an
-    input test.
 
-    The mismatched tuples contain the test values (line, input,
-    expected).
+# The kinds of failures reported by check_tests().
+MISMATCH = 'mismatch'
+CYCLE = 'cycle'
+TOO_MANY_HOPS = 'too_many_hops'
 
-    :param ruleset: The redirect rules.
-    :type ruleset: RuleSet
 
-    """
-    used = set()
-    mismatches = []
-    cycles = []
-    too_many_hops = []
+def _check_tests(resolver, tests, max_hops, used):
     for test in tests:
-        matches = _find_matches(ruleset, test)
+        matches = _find_matches(resolver, test)
         if not matches:
             # No rules matched at all. If the test was expecting
             # that don't record it as a failure.
             if test[2] == '200':
                 used.add(test[0])
             else:
-                mismatches.append((test, []))
+                yield (MISMATCH, test, [])
         else:
             code, expected = test[-2:]
             if (code, expected) != matches[0][1:]:
                 # At least one rule matched, but the first rule to
                 # match gave us an unexpected result to count it as a
                 # failure.
-                mismatches.append((test, matches))
+                yield (MISMATCH, test, matches)
             elif len(matches) == 1:
                 # One rule matched and it matched as expected, so mark
                 # it as used and go on to the next test.
@@ -96,13 +77,122 @@ def process_tests(ruleset, tests, max_hops):
                 # multi-step redirect, which is OK and we can just
                 # recognize that the first rule was tested properly.
                 if matches[0] == matches[-1]:
-                    cycles.append((test, matches))
+                    yield (CYCLE, test, matches)
                 elif max_hops and len(matches) > max_hops:
-                    too_many_hops.append((test, matches))
+                    yield (TOO_MANY_HOPS, test, matches)
                 else:
                     used.add(matches[0][0])
+
+
+# The chain resolver used by the tests running in a worker process.
+_worker_resolver = None
+
+
+def _init_worker(ruleset):
+    global _worker_resolver
+    _worker_resolver = chains.ChainResolver(ruleset)
+
+
+def _check_tests_in_worker(tests, max_hops):
+    used = set()
+    failures = list(_check_tests(_worker_resolver, tests, max_hops, used))
+    # Send back only the limit errors found for this chunk, the parent
+    # adds them to the ones of its own ruleset.
+    limit_errors = _worker_resolver.ruleset.limit_errors
+    chunk_limit_errors = collections.Counter(limit_errors)
+    limit_errors.clear()
+    return (failures, used, chunk_limit_errors)
+
+
+def _check_tests_in_parallel(ruleset, tests, max_hops, used, jobs):
+    # Chunks large enough that sending the tests and results back and
+    # forth stays cheap. Only a few chunks per worker are read ahead,
+    # so memory use does not depend on the size of the test file.
+    chunk_size = 1000
+    tests = iter(tests)
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(ruleset,)) as executor:
+        while True:
+            while len(pending) < jobs * 2:
+                chunk = list(itertools.islice(tests, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(
+                    _check_tests_in_worker, chunk, max_hops))
+            if not pending:
+                break
+            # Wait for the chunks in order, so the failures are
+            # reported in the order the tests appear in the file.
+            failures, chunk_used, limit_errors = pending.popleft().result()
+            used.update(chunk_used)
+            ruleset.limit_errors.update(limit_errors)
+            yield from failures
+
+
+def check_tests(ruleset, tests, max_hops, used, jobs=1):
+    """Run the tests against the ruleset and generate the failures.
+
+    The tests are consumed lazily and each failure is produced as
+    soon as it is found, as a tuple containing the kind of failure
+    (MISMATCH, CYCLE or TOO_MANY_HOPS), the test, and the list of
+    matches found for the test.
+
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+    :param tests: Iterable of (line, input, code, expected) tuples.
+    :param max_hops: How many redirects are allowed, or 0 for any.
+    :type max_hops: int
+    :param used: Set updated with the line numbers of the rules that
+                 matched a test as expected.
+    :type used: set
+    :param jobs: How many processes to split the tests between.
+    :type jobs: int
+
+    """
+    if jobs > 1:
+        return _check_tests_in_parallel(
+            ruleset, tests, max_hops, used, jobs)
+    resolver = chains.ChainResolver(ruleset)
+    return _check_tests(resolver, tests, max_hops, used)
+
+
+def process_tests(ruleset, tests, max_hops, jobs=1):
+    """Run the tests against the ruleset and return the results.
+
+    The return value is a tuple containing a list of tuples with the
+    inputs that did not match the expected value, a list of tuples
+    with inputs and rules the result in redirect cycles, and a set
+    containing the line numbers of the rules that never matched an
+    input test.
+
+    The mismatched tuples contain the test values (line, input,
+    expected).
+
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+    :param jobs: How many processes to split the tests between.
+    :type jobs: int
+
+    """
+    used = set()
+    results = {
+        MISMATCH: [],
+        CYCLE: [],
+        TOO_MANY_HOPS: [],
+    }
+    for kind, test, matches in check_tests(
+            ruleset, tests, max_hops, used, jobs):
+        results[kind].append((test, matches))
     untested = set(ruleset.all_ids) - used
-    return (mismatches, cycles, too_many_hops, untested)
+    return (
+        results[MISMATCH],
+        results[CYCLE],
+        results[TOO_MANY_HOPS],
+        untested,
+    )
 
 
 # This is constructed outside of the main() function to support
@@ -128,6 +218,84 @@ argument_parser.add_argument(
     default=0,
     help='how many hops are allowed',
 )
+argument_parser.add_argument(
+    '--analyze',
+    action='store_true',
+    default=False,
+    help=('look for redirect cycles, long chains and unreachable rules '
+          'in the rules themselves'),
+)
+argument_parser.add_argument(
+    '--max-failures',
+    type=int,
+    default=0,
+    help='stop after this many tests fail',
+)
+argument_parser.add_argument(
+    '-j', '--jobs',
+    type=int,
+    default=1,
+    help='how many processes to run the tests in',
+)
+argument_parser.add_argument(
+    '--cache-size',
+    type=int,
+    default=0,
+    help='how many rule match results to cache',
+)
+argument_parser.add_argument(
+    '--rules-cache',
+    metavar='DIR',
+    help='directory for saving parsed rules to reuse in later runs',
+)
+argument_parser.add_argument(
+    '--lazy',
+    action='store_true',
+    default=False,
+    help=('compile each regular expression when a test first needs it '
+          'instead of when loading the rules, which is faster for '
+          'large rule files with few tests'),
+)
+argument_parser.add_argument(
+    '--match-limit',
+    type=int,
+    default=0,
+    metavar='N',
+    help=('treat a RedirectMatch rule as not matching a path when PCRE2 '
+          'needs more than N backtracking steps, 0 for the PCRE2 '
+          'default'),
+)
+argument_parser.add_argument(
+    '--depth-limit',
+    type=int,
+    default=0,
+    metavar='N',
+    help=('limit how deeply PCRE2 may nest while matching a pattern '
+          'that is not JIT compiled, 0 for the PCRE2 default'),
+)
+argument_parser.add_argument(
+    '--incremental',
+    metavar='STATEFILE',
+    help=('save the results of the tests to a file and on later runs '
+          'only evaluate the tests affected by changes to the rules'),
+)
+argument_parser.add_argument(
+    '--trace',
+    metavar='FILE',
+    help='write the rule that matched each path to a file',
+)
+argument_parser.add_argument(
+    '--profile',
+    type=int,
+    metavar='N',
+    help=('measure the time spent evaluating each rule and show the N '
+          'rules that took the longest'),
+)
+argument_parser.add_argument(
+    '--profile-output',
+    metavar='FILE',
+    help='write the time spent evaluating each rule to a JSON file',
+)
 argument_parser.add_argument(
     '-v', '--verbose',
     dest='verbosity',
@@ -149,10 +317,33 @@ argument_parser.add_argument(
 )
 argument_parser.add_argument(
     'test_file',
+    nargs='?',
     help='file with test data',
 )
 
 
+class TraceFile:
+    """Write the trace records of a RuleSet to a file.
+
+    Each record becomes a tab-separated line with the rule line
+    number, the path, the response code and the target. Fields that
+    do not apply are written as '-'.
+
+    """
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def append(self, record):
+        linenum, path, result = record
+        if result is None:
+            code = target = None
+        else:
+            code, target = result
+        self._fd.write('{}\t{}\t{}\t{}\n'.format(
+            linenum or '-', path, code or '-', target or '-'))
+
+
 def show_test_and_matches(msg, test, matches):
     logging.error(
         '{} on line {}: {} should produce {} {}'.format(
@@ -164,8 +355,83 @@ def show_test_and_matches(msg, test, matches):
             path, code, new_path, linenum))
 
 
+def show_rules(msg, linenums, ruleset):
+    logging.error(msg)
+    for linenum in linenums:
+        logging.error('   {}'.format(ruleset[linenum]))
+
+
+def show_profile(ruleset, top, output=None):
+    """Show the rules that took the longest to evaluate.
+
+    :param ruleset: The rules, with a profiler.RuleProfiler.
+    :type ruleset: RuleSet
+    :param top: How many rules to show.
+    :type top: int
+    :param output: Name of a file to write the full report to as JSON.
+    :type output: str
+
+    """
+    report = ruleset.profiler.report(ruleset)
+    log = logging.getLogger()
+    log.info('{} rule evaluations for {} paths took {:.1f} ms'.format(
+        report['evaluations'], report['paths'], report['total_us'] / 1000))
+    for r in report['rules'][:top or 0]:
+        log.info('{:10.1f} us total {:8.1f} us max {:8d} evaluations  '
+                 '{}'.format(r['total_us'], r['max_us'], r['evaluations'],
+                             r['rule']))
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+def analyze_rules(ruleset, max_hops, error_unreachable=True):
+    """Report redirect cycles, long chains and unreachable rules.
+
+    Returns the number of problems found. Unreachable rules are only
+    counted if error_unreachable is true.
+
+    """
+    graph = analysis.build_graph(ruleset)
+    cycles, long_chains = analysis.find_chains(graph, max_hops)
+    for cycle in cycles:
+        show_rules(
+            'Cycle found in rules starting on line {}'.format(cycle[0]),
+            cycle + cycle[:1],
+            ruleset,
+        )
+    for chain in long_chains:
+        show_rules(
+            'Excessive redirects found from rule on line {}'.format(
+                chain[0]),
+            chain,
+            ruleset,
+        )
+    problems = len(cycles) + len(long_chains)
+    for linenum, earlier, reason in analysis.find_unreachable(ruleset):
+        if reason == 'duplicate':
+            msg = 'Duplicate of rule on line {}'.format(earlier)
+        else:
+            msg = 'Shadowed by rule on line {}'.format(earlier)
+        logging.error('{}: {}'.format(msg, ruleset[linenum]))
+        if error_unreachable:
+            problems += 1
+    return problems
+
+
 def main():
     args = argument_parser.parse_args()
+    if not args.test_file and not args.analyze:
+        argument_parser.error('a test file is required without --analyze')
+    if args.trace and args.jobs > 1:
+        argument_parser.error('--trace cannot be used with --jobs')
+    if args.incremental and args.jobs > 1:
+        argument_parser.error('--incremental cannot be used with --jobs')
+    if args.incremental and args.trace:
+        argument_parser.error('--incremental cannot be used with --trace')
+    profiling = args.profile is not None or bool(args.profile_output)
+    if profiling and args.jobs > 1:
+        argument_parser.error('--profile cannot be used with --jobs')
 
     verbosity = sum(args.verbosity)
     if verbosity < 1:
@@ -182,55 +448,92 @@ def main():
     )
     log = logging.getLogger()
 
-    ruleset = rules.RuleSet()
-
     log.debug('reading redirects from {}'.format(args.htaccess_file))
-    with open(args.htaccess_file, encoding='utf-8') as f:
-        for linenum, params in parser.parse_rules(f):
-            ruleset.add(linenum, *params)
+    ruleset = loader.load_ruleset(
+        args.htaccess_file,
+        cache_dir=args.rules_cache,
+        cache_size=args.cache_size,
+        lazy=args.lazy,
+        match_limit=args.match_limit,
+        depth_limit=args.depth_limit,
+    )
 
-    log.debug('reading tests from {}'.format(args.htaccess_file))
+    failures = 0
+    if args.analyze:
+        failures += analyze_rules(
+            ruleset, args.max_hops, args.error_untested)
+    if not args.test_file:
+        if failures:
+            logging.error('{} failures'.format(failures))
+            return 1
+        return 0
+
+    used = set()
+    stopped = False
+    if profiling:
+        ruleset.profiler = profiler.RuleProfiler()
+    if args.trace:
+        trace_file = open(args.trace, 'w', encoding='utf-8')
+        ruleset.trace = TraceFile(trace_file)
+
+    if args.incremental:
+        resolver = incremental.IncrementalResolver(
+            ruleset, incremental.load_state(args.incremental))
+
+    log.debug('reading tests from {}'.format(args.test_file))
     with open(args.test_file, encoding='utf-8') as f:
-        tests = [
+        tests = (
             (linenum,) + tuple(params)
             for linenum, params in parser.parse_tests(f)
-        ]
-
-    failures = 0
-    mismatches, cycles, too_many_hops, untested = process_tests(
-        ruleset, tests, args.max_hops)
-
-    for test, matches in mismatches:
-        failures += 1
-        if matches:
-            show_test_and_matches(
-                'Unexpected rule matched test',
-                test,
-                matches,
-            )
+        )
+        if args.incremental:
+            results = _check_tests(resolver, tests, args.max_hops, used)
         else:
-            show_test_and_matches(
-                'No rule matched test',
-                test,
-                [],
-            )
+            results = check_tests(
+                ruleset, tests, args.max_hops, used, args.jobs)
+        for kind, test, matches in results:
+            failures += 1
+            if kind == MISMATCH and matches:
+                msg = 'Unexpected rule matched test'
+            elif kind == MISMATCH:
+                msg = 'No rule matched test'
+            elif kind == CYCLE:
+                msg = 'Cycle found from rule'
+            else:
+                msg = 'Excessive redirects found from rule'
+            show_test_and_matches(msg, test, matches)
+            if args.max_failures and failures >= args.max_failures:
+                stopped = True
+                break
 
-    for test, matches in cycles:
-        failures += 1
-        show_test_and_matches(
-            'Cycle found from rule',
-            test,
-            matches,
-        )
+    if args.trace:
+        ruleset.trace = None
+        trace_file.close()
+    if profiling:
+        show_profile(ruleset, args.profile, args.profile_output)
+        ruleset.profiler = None
+    for linenum, count in sorted(ruleset.limit_errors.items()):
+        log.warning('Rule exceeded the match limits for {} paths: {}'.format(
+            count, ruleset[linenum]))
+    if args.cache_size:
+        log.debug('match cache: {} hits, {} misses'.format(
+            ruleset.cache_hits, ruleset.cache_misses))
 
-    for test, matches in too_many_hops:
-        failures += 1
-        show_test_and_matches(
-            'Excessive redirects found from rule',
-            test,
-            matches,
-        )
+    if args.incremental and not stopped:
+        log.debug('{} test paths reused from the last run, {} '
+                  'evaluated'.format(resolver.reused, resolver.evaluated))
+        try:
+            incremental.save_state(args.incremental, ruleset, resolver)
+        except OSError as e:
+            log.warning('Could not write state file {}: {}'.format(
+                args.incremental, e))
 
+    if stopped:
+        # Not every test ran, so the untested rules are not known.
+        logging.error('Stopped after {} failures'.format(failures))
+        return 1
+
+    untested = set(ruleset.all_ids) - used
     if untested:
         log.debug('')
         for linenum in sorted(untested):
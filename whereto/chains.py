@@ -0,0 +1,91 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# How many redirects to follow before giving up on a chain.
+MAX_CHAIN = 5
+
+
+class ChainResolver:
+    """Follow redirect chains, remembering what was found.
+
+    The resolver keeps a graph of the paths seen so far, mapping each
+    path to the match the rules produce for it, and the chain of
+    matches starting at each path. Tests sharing paths or chain tails
+    only evaluate the rules once for each distinct path.
+
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+    :param max_paths: How many paths to remember before starting
+                      over, to bound memory use.
+    :type max_paths: int
+
+    """
+
+    def __init__(self, ruleset, max_paths=100000):
+        self.ruleset = ruleset
+        self.max_paths = max_paths
+        self._hops = {}
+        self._chains = {}
+
+    def hop(self, path):
+        """Return the match for path, like RuleSet.match()."""
+        try:
+            return self._hops[path]
+        except KeyError:
+            pass
+        if len(self._hops) >= self.max_paths:
+            self._hops.clear()
+            self._chains.clear()
+        match = self._hops[path] = self.ruleset.match(path)
+        return match
+
+    def resolve(self, path):
+        """Return the list of matches found by following redirects.
+
+        The chain stops at a path no rule matches, at a rule without a
+        target, like a 410, after a rule is matched a second time, or
+        after MAX_CHAIN matches.
+
+        """
+        try:
+            chain = self._chains[path]
+        except KeyError:
+            chain = self._chains[path] = self._walk(path)
+        return list(chain)
+
+    def _walk(self, path):
+        seen = set()
+        matches = []
+        match = self.hop(path)
+        while match is not None and len(matches) < MAX_CHAIN:
+            matches.append(match)
+            if match[0] in seen:
+                # cycle, stop
+                break
+            seen.add(match[0])
+            if match[-1] is None:
+                # a redirect that doesn't point to a path, like a 410
+                break
+            tail = self._chains.get(match[-1])
+            if tail is not None:
+                # The rest of the chain is known. It is produced by
+                # the same hops, so just stop at the same places.
+                for match in tail:
+                    if len(matches) >= MAX_CHAIN:
+                        break
+                    matches.append(match)
+                    if match[0] in seen:
+                        break
+                    seen.add(match[0])
+                break
+            match = self.hop(match[-1])
+        return tuple(matches)
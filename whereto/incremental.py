@@ -0,0 +1,221 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import difflib
+import json
+import logging
+import os
+import tempfile
+
+from whereto import chains
+from whereto import rules
+
+
+LOG = logging.getLogger()
+
+# Change this when the contents of the state file change, so old state
+# files are ignored.
+STATE_FORMAT = 1
+
+
+def rule_key(rule):
+    """Return the parts of a rule that decide what it matches.
+
+    Two rules with the same key behave the same way, wherever they
+    appear in the file.
+
+    """
+    return (type(rule).__name__, rule.code, rule.pattern, rule.target)
+
+
+def map_rules(old_keys, new_keys):
+    """Return a dict mapping old rule indexes to new rule indexes.
+
+    Only rules left unchanged by the edit are included. Rules that
+    were changed, moved, or removed are missing from the dict, and
+    new rules missing from its values were changed, moved, or added.
+
+    """
+    mapping = {}
+    # Most edits touch a few lines, so only compare the part of the
+    # rules between the unchanged start and end.
+    start = 0
+    limit = min(len(old_keys), len(new_keys))
+    while start < limit and old_keys[start] == new_keys[start]:
+        mapping[start] = start
+        start += 1
+    end = 0
+    while end < limit - start:
+        if old_keys[-1 - end] != new_keys[-1 - end]:
+            break
+        end += 1
+    matcher = difflib.SequenceMatcher(
+        None,
+        old_keys[start:len(old_keys) - end],
+        new_keys[start:len(new_keys) - end],
+        autojunk=False,
+    )
+    for old, new, size in matcher.get_matching_blocks():
+        for i in range(size):
+            mapping[start + old + i] = start + new + i
+    shift = len(new_keys) - len(old_keys)
+    for i in range(len(old_keys) - end, len(old_keys)):
+        mapping[i] = i + shift
+    return mapping
+
+
+def _queried_paths(path, chain):
+    # The paths looked up while following the chain. The target of the
+    # last match may not have been looked up, but including it only
+    # means the test is evaluated again when it did not need to be.
+    yield path
+    for linenum, code, target in chain:
+        if target is not None:
+            yield target
+
+
+class IncrementalResolver:
+    """Follow redirect chains, reusing the chains from an earlier run.
+
+    A chain saved by an earlier run is reused when every rule it
+    matched is still in the rules unchanged, and none of the rules
+    that were changed or added match a path looked up while following
+    it. Since the rules are tried in order, the remaining rules produce
+    the same matches for those paths as before, so the chain only
+    needs its line numbers updated. Other chains are found again with
+    a ChainResolver.
+
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+    :param state: The state saved by an earlier run, from load_state(),
+                  or None.
+    :type state: dict
+
+    """
+
+    def __init__(self, ruleset, state=None):
+        self._resolver = chains.ChainResolver(ruleset)
+        self.chains = {}
+        self.reused = 0
+        self.evaluated = 0
+        self._old_chains = {}
+        self._linemap = {}
+        self._added = rules.RuleSet()
+        self._has_added = False
+        if state:
+            self._prepare(ruleset, state)
+
+    def _prepare(self, ruleset, state):
+        new_rules = list(ruleset)
+        old_linenums = [r[0] for r in state['rules']]
+        mapping = map_rules(
+            [tuple(r[1:]) for r in state['rules']],
+            [rule_key(r) for r in new_rules],
+        )
+        self._linemap = {
+            old_linenums[old]: new_rules[new].linenum
+            for old, new in mapping.items()
+        }
+        unchanged = set(mapping.values())
+        for i, rule in enumerate(new_rules):
+            if i not in unchanged:
+                self._added.add_rule(rule)
+                self._has_added = True
+        self._old_chains = state['chains']
+        LOG.debug('%d of %d rules changed since the last run',
+                  len(new_rules) - len(unchanged), len(new_rules))
+
+    def _reuse(self, path):
+        old = self._old_chains.get(path)
+        if old is None:
+            return None
+        chain = []
+        for linenum, code, target in old:
+            linenum = self._linemap.get(linenum)
+            if linenum is None:
+                return None
+            chain.append((linenum, code, target))
+        if self._has_added:
+            for queried in _queried_paths(path, chain):
+                if self._added.match(queried) is not None:
+                    return None
+        return tuple(chain)
+
+    def resolve(self, path):
+        """Return the list of matches found by following redirects.
+
+        See ChainResolver.resolve().
+
+        """
+        chain = self.chains.get(path)
+        if chain is None:
+            chain = self._reuse(path)
+            if chain is None:
+                self.evaluated += 1
+                chain = tuple(self._resolver.resolve(path))
+            else:
+                self.reused += 1
+            self.chains[path] = chain
+        return list(chain)
+
+
+def load_state(filename):
+    """Return the state saved by save_state(), or None.
+
+    Missing, unreadable, or outdated state files are ignored, so every
+    test is evaluated.
+
+    """
+    try:
+        with open(filename, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        LOG.warning('Ignoring unreadable state file %s: %s', filename, e)
+        return None
+    if not isinstance(state, dict) or state.get('format') != STATE_FORMAT:
+        LOG.warning('Ignoring state file %s from another version',
+                    filename)
+        return None
+    return state
+
+
+def save_state(filename, ruleset, resolver):
+    """Save the rules and the chains found by resolver for the next run.
+
+    :param filename: The state file.
+    :type filename: str
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+    :param resolver: The resolver used to run the tests.
+    :type resolver: IncrementalResolver
+
+    """
+    state = {
+        'format': STATE_FORMAT,
+        'rules': [
+            [rule.linenum] + list(rule_key(rule)) for rule in ruleset
+        ],
+        'chains': resolver.chains,
+    }
+    dirname = os.path.dirname(os.path.abspath(filename))
+    # Write to a temporary file and rename it so an interrupted run
+    # never leaves a partial state file.
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
@@ -0,0 +1,164 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import io
+import logging
+import os
+import pickle
+import tempfile
+
+from whereto import analysis
+from whereto import parser
+from whereto import rules
+
+
+LOG = logging.getLogger()
+
+# Change this when the pickled form of the rules changes, so old cache
+# files are ignored.
+CACHE_FORMAT = 6
+
+
+def parse_ruleset(fd, **kwargs):
+    """Parse an open file containing redirect rules into a RuleSet.
+
+    :param fd: Open file handle or other data source supporting
+               iteration over lines, producing unicode strings.
+    :type fd: io.BufferedReader
+    :param kwargs: Passed to the RuleSet.
+
+    """
+    ruleset = rules.RuleSet(**kwargs)
+    for linenum, params in parser.parse_rules(fd):
+        ruleset.add(linenum, *params)
+    return ruleset
+
+
+def cache_filename(cache_dir, content, match_limit=0, depth_limit=0):
+    """Return the name of the cache file for the given rules content.
+
+    The rules keep their PCRE2 limits, so rules loaded with different
+    limits are cached separately.
+
+    """
+    digest = hashlib.sha256(content)
+    digest.update(rules.limit_verbs(match_limit, depth_limit).encode())
+    return os.path.join(
+        cache_dir,
+        'rules-{}-{}.pickle'.format(CACHE_FORMAT, digest.hexdigest()),
+    )
+
+
+def lint_ruleset(ruleset):
+    """Warn about patterns that may take a long time to match.
+
+    Returns the number of rules found.
+
+    """
+    found = analysis.find_nested_quantifiers(ruleset)
+    for linenum, group in found:
+        LOG.warning('Nested quantifiers in %s may backtrack excessively: %s',
+                    group, ruleset[linenum])
+    return len(found)
+
+
+def _read_cache(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        LOG.warning('Ignoring unreadable rules cache %s: %s', filename, e)
+    return None
+
+
+def _write_cache(filename, ruleset):
+    try:
+        dirname = os.path.dirname(filename)
+        os.makedirs(dirname, exist_ok=True)
+        # Write to a temporary file and rename it so concurrent runs
+        # never see a partial cache file.
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(ruleset, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+    except OSError as e:
+        LOG.warning('Could not write rules cache %s: %s', filename, e)
+
+
+def load_ruleset(filename, cache_dir=None, cache_size=0, lazy=False,
+                 match_limit=0, depth_limit=0):
+    """Load the redirect rules in filename into a RuleSet.
+
+    If cache_dir is set, the parsed rules are saved there in a file
+    named after a hash of the contents of filename, and later calls
+    for the same contents load that file instead of parsing the rules
+    again. Only use a cache directory that is not writable by
+    untrusted users, since the cache files are pickles.
+
+    :param filename: The file with the redirect rules.
+    :type filename: str
+    :param cache_dir: Directory for the cache files, or None.
+    :type cache_dir: str
+    :param cache_size: Passed to the RuleSet.
+    :type cache_size: int
+    :param lazy: Passed to the RuleSet. Rules loaded from the cache
+                 always compile their patterns on first use. Only
+                 rules whose patterns all compile are written to the
+                 cache, so the patterns of lazily parsed rules are
+                 compiled before writing it.
+    :type lazy: bool
+    :param match_limit: Passed to the RuleSet.
+    :type match_limit: int
+    :param depth_limit: Passed to the RuleSet.
+    :type depth_limit: int
+
+    """
+    with open(filename, 'rb') as f:
+        content = f.read()
+    cache_file = None
+    if cache_dir:
+        cache_file = cache_filename(
+            cache_dir, content, match_limit, depth_limit)
+        ruleset = _read_cache(cache_file)
+        if ruleset is not None:
+            LOG.debug('loaded rules from cache %s', cache_file)
+            ruleset.cache_size = cache_size
+            ruleset.lazy = lazy
+            lint_ruleset(ruleset)
+            return ruleset
+    ruleset = parse_ruleset(
+        io.StringIO(content.decode('utf-8'), newline=None),
+        cache_size=cache_size,
+        lazy=lazy,
+        match_limit=match_limit,
+        depth_limit=depth_limit,
+    )
+    if cache_file:
+        # An eager parse has already failed on invalid patterns. A lazy
+        # one has not, and a cache written from it would let later
+        # eager loads accept them.
+        errors = ruleset.precompile()['errors'] if lazy else []
+        if errors:
+            LOG.warning('Not caching the rules, the patterns on lines %s '
+                        'do not compile',
+                        ', '.join(str(linenum) for linenum, msg in errors))
+        else:
+            _write_cache(cache_file, ruleset)
+    lint_ruleset(ruleset)
+    return ruleset
@@ -13,7 +13,77 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import shlex
+import re
+
+
+# Lines without quotes or backslashes can simply be split on spaces.
+_special = re.compile(r'[\'"\\]')
+_whitespace = re.compile(r'[ \t\r\n]+')
+
+# The pieces of a line using the quoting rules of shlex.split() in
+# POSIX mode. Adjacent pieces that are not whitespace form one token.
+_piece = re.compile(
+    r"""
+    ([^ \t\r\n'"\\]+)      # unquoted text
+    | \\(.)                 # escaped character
+    | '([^']*)'             # single quoted text, without escapes
+    | "((?:[^"\\]|\\.)*)"   # double quoted text
+    | ([ \t\r\n]+)           # token separator
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Inside double quotes only a quote or a backslash can be escaped.
+_double_quote_escape = re.compile(r'\\(["\\])')
+
+# An unterminated double quote ending with an escape character.
+_dangling_escape = re.compile(r'"(?:[^"\\]|\\.)*\\', re.DOTALL)
+
+
+def split_line(line):
+    """Split a line into tokens the way shlex.split() does.
+
+    Tokens are separated by whitespace. Single quotes, double quotes
+    and backslash escapes follow the POSIX shell rules implemented by
+    shlex. Comments are not recognized.
+
+    :param line: The text to split.
+    :type line: str
+    """
+    if not _special.search(line):
+        tokens = _whitespace.split(line)
+        if tokens and not tokens[0]:
+            del tokens[0]
+        if tokens and not tokens[-1]:
+            del tokens[-1]
+        return tokens
+    tokens = []
+    token = None
+    pos = 0
+    end = len(line)
+    while pos < end:
+        m = _piece.match(line, pos)
+        if m is None:
+            if line[pos] == '\\':
+                raise ValueError('No escaped character')
+            if _dangling_escape.fullmatch(line, pos):
+                raise ValueError('No escaped character')
+            raise ValueError('No closing quotation')
+        pos = m.end()
+        plain, escaped, single, double, space = m.groups()
+        if space is not None:
+            if token is not None:
+                tokens.append(token)
+                token = None
+            continue
+        if double is not None:
+            piece = _double_quote_escape.sub(r'\1', double)
+        else:
+            piece = plain or escaped or single or ''
+        token = piece if token is None else token + piece
+    if token is not None:
+        tokens.append(token)
+    return tokens
 
 
 def parse_rules(fd):
@@ -34,7 +104,7 @@ def parse_rules(fd):
             continue
         if line.startswith('#'):
             continue
-        yield (num, shlex.split(line))
+        yield (num, split_line(line))
 
 
 def parse_tests(fd):
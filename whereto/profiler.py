@@ -0,0 +1,114 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+class RuleStats:
+    "What evaluating one rule cost."
+
+    __slots__ = (
+        'evaluations', 'hits', 'errors', 'total', 'max', 'max_path',
+    )
+
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.max_path = None
+
+
+class RuleProfiler:
+    """Collect the time spent evaluating each rule.
+
+    Assign an instance to the profiler attribute of a RuleSet to start
+    collecting. While profiling, the RuleSet evaluates every rule that
+    may match a path on its own instead of using the combined patterns,
+    so the cost of each pattern is known, including backtracking in
+    patterns that do not match. This makes matching slower.
+
+    """
+
+    def __init__(self):
+        self.paths = 0
+        self.stats = {}
+
+    def record(self, linenum, path, elapsed, hit, error=False):
+        """Record one evaluation of the rule on line linenum.
+
+        :param linenum: The line number of the rule.
+        :type linenum: int
+        :param path: The path the rule was evaluated against.
+        :type path: str
+        :param elapsed: How many seconds the evaluation took.
+        :type elapsed: float
+        :param hit: Whether the rule matched the path.
+        :type hit: bool
+        :param error: Whether the evaluation raised an error.
+        :type error: bool
+
+        """
+        try:
+            stats = self.stats[linenum]
+        except KeyError:
+            stats = self.stats[linenum] = RuleStats()
+        stats.evaluations += 1
+        stats.total += elapsed
+        if hit:
+            stats.hits += 1
+        if error:
+            stats.errors += 1
+        if elapsed > stats.max:
+            stats.max = elapsed
+            stats.max_path = path
+
+    def report(self, ruleset, top=None):
+        """Return the costs as a dict that can be saved as JSON.
+
+        The rules are listed from the most to the least total time
+        spent evaluating them, and only rules that were evaluated are
+        included. Times are in microseconds.
+
+        :param ruleset: The rules that were profiled.
+        :type ruleset: RuleSet
+        :param top: How many rules to include, or None for all.
+        :type top: int
+
+        """
+        ranked = sorted(
+            self.stats.items(),
+            key=lambda item: item[1].total,
+            reverse=True,
+        )
+        if top is not None:
+            ranked = ranked[:top]
+        return {
+            'paths': self.paths,
+            'evaluations': sum(s.evaluations for s in self.stats.values()),
+            'total_us': round(
+                sum(s.total for s in self.stats.values()) * 1e6, 3),
+            'rules': [
+                {
+                    'linenum': linenum,
+                    'rule': str(ruleset[linenum]),
+                    'evaluations': stats.evaluations,
+                    'hits': stats.hits,
+                    'errors': stats.errors,
+                    'total_us': round(stats.total * 1e6, 3),
+                    'avg_us': round(
+                        stats.total / stats.evaluations * 1e6, 3),
+                    'max_us': round(stats.max * 1e6, 3),
+                    'max_path': stats.max_path,
+                }
+                for linenum, stats in ranked
+            ],
+        }
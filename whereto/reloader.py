@@ -0,0 +1,167 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import logging
+import os
+import threading
+import time
+
+from whereto import incremental
+from whereto import loader
+
+
+LOG = logging.getLogger()
+
+
+class Reloader:
+    """Replace the rules of a running application when the file changes.
+
+    The rules file is checked with os.stat() every interval seconds.
+    When it changes, the new rules are parsed and compiled in the
+    background and then assigned to the ruleset attribute of target in
+    a single step, so requests always see either the old rules or the
+    new ones. If the new file cannot be parsed, the old rules stay in
+    place until the file changes again.
+
+    :param filename: The file with the redirect rules.
+    :type filename: str
+    :param target: Object with a ruleset attribute to replace, like a
+                   server.WSGIApplication.
+    :param interval: How many seconds to wait between checks.
+    :type interval: float
+    :param cache_size: Passed to the new RuleSet.
+    :type cache_size: int
+    :param hits: Rule hit counts for the rules of target, passed to
+                 RuleSet.optimize() for the new rules, or None. The
+                 counts follow the rules to their new line numbers, and
+                 the counts of changed, reordered or removed rules
+                 are dropped.
+    :type hits: dict
+    :param match_limit: Passed to the new RuleSet.
+    :type match_limit: int
+    :param depth_limit: Passed to the new RuleSet.
+    :type depth_limit: int
+
+    """
+
+    def __init__(self, filename, target, interval=2.0, cache_size=0,
+                 hits=None, match_limit=0, depth_limit=0):
+        self.filename = filename
+        self.target = target
+        self.interval = interval
+        self.cache_size = cache_size
+        self.hits = hits
+        self.match_limit = match_limit
+        self.depth_limit = depth_limit
+        self.reloads = 0
+        self.failures = 0
+        self._signature = self._stat()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def check(self):
+        """Reload the rules if the file changed since the last check.
+
+        Returns True if new rules were put in place.
+
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        return self.reload()
+
+    def reload(self):
+        """Parse the rules file and put the new rules in place.
+
+        Returns True if new rules were put in place.
+
+        """
+        start = time.perf_counter()
+        try:
+            with open(self.filename, 'rb') as f:
+                content = f.read()
+            ruleset = loader.parse_ruleset(
+                io.StringIO(content.decode('utf-8'), newline=None),
+                cache_size=self.cache_size,
+                match_limit=self.match_limit,
+                depth_limit=self.depth_limit,
+            )
+            ruleset.compile()
+            hits = None
+            if self.hits:
+                hits = self._map_hits(self.target.ruleset, ruleset)
+                ruleset.optimize(hits)
+        except Exception as e:
+            self.failures += 1
+            LOG.error('Keeping the old rules, could not load %s: %s',
+                      self.filename, e)
+            return False
+        loader.lint_ruleset(ruleset)
+        old_count = len(self.target.ruleset.all_ids)
+        self.target.ruleset = ruleset
+        if hits is not None:
+            self.hits = hits
+        self.reloads += 1
+        LOG.info('reloaded %s in %.3f seconds: %d rules, was %d',
+                 self.filename, time.perf_counter() - start,
+                 len(ruleset.all_ids), old_count)
+        return True
+
+    def _map_hits(self, old_ruleset, new_ruleset):
+        # The counts are keyed by line number, so after an edit they
+        # would apply to whatever rule ended up on the same line. Move
+        # each count to the line of the same rule in the new file.
+        old_rules = list(old_ruleset)
+        new_rules = list(new_ruleset)
+        mapping = incremental.map_rules(
+            [incremental.rule_key(rule) for rule in old_rules],
+            [incremental.rule_key(rule) for rule in new_rules],
+        )
+        hits = {}
+        for old, new in mapping.items():
+            count = self.hits.get(old_rules[old].linenum)
+            if count:
+                hits[new_rules[new].linenum] = count
+        return hits
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                LOG.exception('Error checking %s for changes', self.filename)
+
+    def start(self):
+        """Start checking for changes in a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='whereto-reloader',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and wait for it to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,270 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import collections
+import contextlib
+import gzip
+import io
+import itertools
+import json
+import logging
+import re
+import sys
+import urllib.parse
+
+from whereto import loader
+from whereto import profiler
+
+
+LOG = logging.getLogger()
+
+# The request line of the common and combined log formats, like
+# "GET /path?query HTTP/1.1".
+_request = re.compile(r'"[A-Z]+ (\S+)(?: HTTP/[0-9.]+)?"')
+
+
+def request_path(line):
+    """Return the path requested in an access log line, or None.
+
+    Lines in the common or combined log format are supported, as well
+    as lines starting with a path. The query string is removed and the
+    path is decoded, like the paths Apache compares with the rules.
+
+    """
+    if line.startswith('/'):
+        target = line.split(None, 1)[0]
+    else:
+        m = _request.search(line)
+        if m is None:
+            return None
+        target = m.group(1)
+    if not target.startswith('/'):
+        # An absolute URL, as sent to proxies.
+        target = urllib.parse.urlsplit(target).path
+        if not target:
+            return None
+    target = target.split('?', 1)[0]
+    return urllib.parse.unquote(target, errors='replace')
+
+
+@contextlib.contextmanager
+def open_log(filename):
+    """Open an access log for reading text, decompressing it if needed.
+
+    Use as a context manager, which closes the file when done. Files
+    compressed with gzip are recognized by their contents, and '-'
+    reads standard input, which is left open.
+
+    """
+    with contextlib.ExitStack() as stack:
+        if filename == '-':
+            raw = sys.stdin.buffer
+        else:
+            raw = stack.enter_context(open(filename, 'rb'))
+        if raw.peek(2)[:2] == b'\x1f\x8b':
+            # Closing a GzipFile does not close the file it reads.
+            raw = stack.enter_context(gzip.GzipFile(fileobj=raw))
+        f = io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+        try:
+            yield f
+        finally:
+            # The layers below are closed by the stack, if they are
+            # ours, so do not let the wrapper close them.
+            f.detach()
+
+
+class HitCounter:
+    """Count the requests matched by each rule and what they cost.
+
+    The rules are matched with a RuleProfiler attached to the ruleset,
+    so the time spent in each rule is measured on its own, including
+    the rules evaluated for a path without matching it.
+
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+
+    """
+
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+        self.profiler = profiler.RuleProfiler()
+        self.requests = 0
+        self.unmatched = 0
+        # Indexed by rule line number, with None for requests that did
+        # not match any rule.
+        self.hits = collections.Counter()
+
+    def add(self, paths):
+        """Match a batch of requested paths and count the results.
+
+        Each distinct path in the batch is only matched once, and
+        counted for every request for it.
+
+        """
+        previous = self.ruleset.profiler
+        self.ruleset.profiler = self.profiler
+        try:
+            match = self.ruleset.match
+            for path, count in collections.Counter(paths).items():
+                result = match(path)
+                linenum = None if result is None else result[0]
+                self.requests += count
+                self.hits[linenum] += count
+        finally:
+            self.ruleset.profiler = previous
+        self.unmatched = self.hits[None]
+
+    def report(self):
+        """Return the counts as a dict that can be saved as JSON.
+
+        The rules are listed in file order, including rules no request
+        matched. Costs are the average time one evaluation of the rule
+        took, in microseconds, or None for rules that were never
+        evaluated.
+
+        """
+        def average(linenum):
+            stats = self.profiler.stats.get(linenum)
+            if stats is None:
+                return None
+            return round(stats.total / stats.evaluations * 1e6, 3)
+
+        return {
+            'requests': self.requests,
+            'unmatched': self.unmatched,
+            'unmatched_share': (
+                self.unmatched / self.requests if self.requests else 0.0
+            ),
+            'rules': [
+                {
+                    'linenum': rule.linenum,
+                    'rule': str(rule),
+                    'hits': self.hits[rule.linenum],
+                    'avg_cost_us': average(rule.linenum),
+                }
+                for rule in self.ruleset
+            ],
+        }
+
+
+def replay(ruleset, log_files, batch_size=10000):
+    """Match the requests in the access logs against the rules.
+
+    The logs are read in batches of batch_size lines, so memory use
+    does not depend on the size of the logs.
+
+    Returns a tuple containing a HitCounter and the number of lines
+    with no request path.
+
+    """
+    counter = HitCounter(ruleset)
+    skipped = 0
+    for filename in log_files:
+        LOG.debug('reading requests from %s', filename)
+        with open_log(filename) as f:
+            while True:
+                lines = list(itertools.islice(f, batch_size))
+                if not lines:
+                    break
+                paths = []
+                for line in lines:
+                    path = request_path(line)
+                    if path is None:
+                        skipped += 1
+                    else:
+                        paths.append(path)
+                counter.add(paths)
+    return (counter, skipped)
+
+
+def load_hit_counts(filename):
+    """Return a dict mapping rule line numbers to hits from a report.
+
+    :param filename: A JSON report written by whereto-replay.
+    :type filename: str
+
+    """
+    with open(filename, encoding='utf-8') as f:
+        report = json.load(f)
+    return {r['linenum']: r['hits'] for r in report['rules']}
+
+
+argument_parser = argparse.ArgumentParser(
+    description=('Count how often the rules match the requests in web '
+                 'server access logs.'),
+)
+argument_parser.add_argument(
+    '-o', '--output',
+    metavar='FILE',
+    help='write the hit counts and costs of every rule to a JSON file',
+)
+argument_parser.add_argument(
+    '--top',
+    type=int,
+    default=10,
+    help='how many of the most used rules to show',
+)
+argument_parser.add_argument(
+    '--rules-cache',
+    metavar='DIR',
+    help='directory for saving parsed rules to reuse in later runs',
+)
+argument_parser.add_argument(
+    '-v', '--verbose',
+    action='store_true',
+    default=False,
+    help='show more detail',
+)
+argument_parser.add_argument(
+    'htaccess_file',
+    help='file with rewrite rules',
+)
+argument_parser.add_argument(
+    'log_file',
+    nargs='+',
+    help='access log, optionally compressed with gzip, or - for stdin',
+)
+
+
+def main():
+    args = argument_parser.parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='whereto-replay %(levelname)s: %(message)s',
+        stream=sys.stdout,
+    )
+    ruleset = loader.load_ruleset(
+        args.htaccess_file,
+        cache_dir=args.rules_cache,
+    )
+    counter, skipped = replay(ruleset, args.log_file)
+    report = counter.report()
+    if skipped:
+        LOG.warning('skipped %d lines without a request path', skipped)
+    LOG.info('%d requests, %d (%.1f%%) not matched by any rule',
+             report['requests'], report['unmatched'],
+             report['unmatched_share'] * 100)
+    used = sorted(
+        (r for r in report['rules'] if r['hits']),
+        key=lambda r: r['hits'],
+        reverse=True,
+    )
+    LOG.info('%d of %d rules matched a request',
+             len(used), len(report['rules']))
+    for r in used[:args.top]:
+        LOG.info('%10d hits %8.1f us  %s',
+                 r['hits'], r['avg_cost_us'], r['rule'])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
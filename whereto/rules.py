@@ -13,44 +13,144 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import bisect
+import collections
+import concurrent.futures
+import heapq
 import logging
 import pcre2
 import re
+import sys
+import time
 
 
 LOG = logging.getLogger()
 
 
+def limit_verbs(match_limit=0, depth_limit=0):
+    """Return the PCRE2 verbs that lower the limits for a pattern.
+
+    The verbs go at the start of a pattern. A match that needs more
+    backtracking than match_limit allows, or nests deeper than
+    depth_limit, fails with an error instead of running for a long
+    time. The depth limit does not apply to JIT compiled patterns. 0
+    keeps the default of the PCRE2 library.
+
+    """
+    verbs = ''
+    if match_limit:
+        verbs += '(*LIMIT_MATCH={:d})'.format(match_limit)
+    if depth_limit:
+        verbs += '(*LIMIT_DEPTH={:d})'.format(depth_limit)
+    return verbs
+
+
+def exceeded_limit(error):
+    """Return True if error means a match ran into a PCRE2 limit."""
+    if not isinstance(error, pcre2.LibraryError):
+        return False
+    return str(error).endswith('limit exceeded')
+
+
+def _compile(pattern, jit=True, limits=(0, 0)):
+    """Compile a regular expression with PCRE2.
+
+    With jit, the pattern is also compiled to machine code, which makes
+    matching faster. If PCRE2 was built without JIT support or cannot
+    JIT compile the pattern, it is matched by the interpreter instead.
+    limits is a (match_limit, depth_limit) tuple, see limit_verbs().
+
+    """
+    limits = limit_verbs(*limits)
+    try:
+        regex = pcre2.compile(limits + pattern, jit=False)
+    except pcre2.PatternError:
+        if limits:
+            # Report the error with positions in the pattern as written.
+            pcre2.compile(pattern, jit=False)
+        raise
+    if jit:
+        try:
+            regex.jit_compile()
+        except pcre2.LibraryError as e:
+            LOG.debug('Matching %s without JIT: %s', pattern, e)
+    return regex
+
+
 class Rule:
-    "Base class for rules."
+    """Base class for rules.
+
+    :param linenum: The line number of the rule.
+    :type linenum: int
+    :param params: The words of the rule line.
+    :param lazy: Delay the expensive parts of preparing the rule, like
+                 compiling a regular expression, until it is first
+                 matched or compiled.
+    :type lazy: bool
+    :param jit: JIT compile regular expressions when possible.
+    :type jit: bool
+    :param limits: The PCRE2 match and depth limits for regular
+                   expressions, see limit_verbs().
+    :type limits: tuple
+
+    """
 
-    def __init__(self, linenum, *params):
+    # Large rule files have many thousands of rules, so they do without
+    # a __dict__. The directive name is kept as written for __str__,
+    # and _code_given records whether the code was written or implied.
+    __slots__ = (
+        'linenum', 'code', 'pattern', 'target', '_keyword', '_code_given',
+    )
+
+    def __init__(self, linenum, *params, lazy=False, jit=True,
+                 limits=(0, 0)):
         self.linenum = linenum
-        self._params = params
         if len(params) == 4:
             # redirect code pattern target
-            self.code = params[1]
+            self.code = sys.intern(params[1])
             self.pattern = params[2]
             self.target = params[3]
+            self._code_given = True
         elif len(params) == 3:
-            if params[1] == '410':
+            if params[1] in ('410', 'gone'):
                 # The page has been deleted and is not coming back.
-                self.code = params[1]
+                self.code = sys.intern(params[1])
                 self.pattern = params[2]
                 self.target = None
+                self._code_given = True
             else:
                 # redirect pattern target
                 # (code is implied)
                 self.code = '301'
                 self.pattern = params[1]
                 self.target = params[2]
+                self._code_given = False
         else:
             raise ValueError('Could not understand rule {}'.format(params))
+        self._keyword = sys.intern(params[0])
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __str__(self):
+        params = (
+            self._keyword,
+            self.code if self._code_given else None,
+            self.pattern,
+            self.target,
+        )
         return '[{}] {}'.format(
             self.linenum,
-            ' '.join(p for p in self._params if p),
+            ' '.join(p for p in params if p),
         )
 
     def match(self, path):
@@ -60,6 +160,8 @@ class Rule:
 class Redirect(Rule):
     "A Redirect rule."
 
+    __slots__ = ()
+
     def match(self, path):
         if path == self.pattern:
             return (self.code, self.target)
@@ -69,47 +171,679 @@ class Redirect(Rule):
 class RedirectMatch(Rule):
     "A RedirectMatch rule with a regular expression."
 
-    _group_subst = re.compile(r'(?<!\\)\$([0-9])')
+    # One piece of a target: a group reference ($1 or ${1}), an
+    # escaped dollar sign ($$), an escaped punctuation character, or
+    # literal text.
+    _group_subst = re.compile(
+        r'\$(?:([0-9]+)|\{([0-9]+)\}|(\$))|\\([^0-9A-Za-z])|([^$\\]+)'
+    )
+
+    # A character that matches itself, either plain or escaped, and a
+    # run of them.
+    _literal = re.compile(r'[^\\.^$|?*+()\[\]{}]|\\[^0-9A-Za-z]')
+    _literal_run = re.compile(r'(?:[^\\.^$|?*+()\[\]{}]|\\[^0-9A-Za-z])*')
+    _escape = re.compile(r'\\(.)', re.S)
 
-    def __init__(self, linenum, *params):
+    __slots__ = (
+        '_regex', 'jit', '_limits', 'anchored', 'prefix', '_target_parts',
+    )
+
+    def __init__(self, linenum, *params, lazy=False, jit=True,
+                 limits=(0, 0)):
         super().__init__(linenum, *params)
-        self.regex = pcre2.compile(self.pattern)
-        if self.target:
-            self.target_repl = self._get_target_repl()
-        else:
-            self.target_repl = None
+        self._regex = None
+        self.jit = jit
+        self._limits = limits
+        # A pattern anchored at the start of the path can only match
+        # once, so the rest of the path never needs to be searched.
+        self.anchored = (
+            self.pattern.startswith('^') and '|' not in self.pattern
+        )
+        self.prefix = self._get_prefix()
+        # Splitting the target needs the number of groups in the
+        # compiled pattern. False means it has not been done yet.
+        self._target_parts = False
+        if not lazy:
+            self.compile()
+            self._target_parts = self._get_target_parts()
+
+    def __getstate__(self):
+        # Compiled patterns are rebuilt on first use after unpickling.
+        state = super().__getstate__()
+        state['_regex'] = None
+        return state
+
+    @property
+    def target_repl(self):
+        if not self.target:
+            return None
+        return self._get_target_repl()
+
+    @property
+    def regex(self):
+        if self._regex is None:
+            self.compile()
+        return self._regex
+
+    @property
+    def target_parts(self):
+        if self._target_parts is False:
+            self._target_parts = self._get_target_parts()
+        return self._target_parts
+
+    def compile(self):
+        """Compile the pattern now instead of on first use.
+
+        Returns True if the pattern was compiled by this call, and False
+        if it was already compiled.
+
+        """
+        if self._regex is not None:
+            return False
+        self._regex = _compile(self.pattern, self.jit, self._limits)
+        return True
+
+    def _get_prefix(self):
+        """Return the literal text every matching path starts with.
+
+        Only patterns anchored with ^ and without alternation have a
+        prefix. None is returned for the others.
+
+        """
+        pattern = self.pattern
+        if not self.anchored:
+            return None
+        run = self._literal_run.match(pattern, 1).group()
+        if run and pattern[1 + len(run):2 + len(run)] in ('?', '*', '{'):
+            # The last character may be repeated zero times.
+            chars = self._literal.findall(run)
+            run = ''.join(chars[:-1])
+        if '\\' in run:
+            run = self._escape.sub(r'\1', run)
+        return run or None
 
     def _get_target_repl(self):
         return self.target
 
+    def _get_target_parts(self):
+        """Split the target into literal strings and group numbers.
+
+        Returns None if the target uses substitution features other
+        than group references and escapes, or refers to a group the
+        pattern does not have.
+
+        """
+        if not self.target:
+            return None
+        parts = []
+        pos = 0
+        target = self.target_repl
+        while pos < len(target):
+            m = self._group_subst.match(target, pos)
+            if not m:
+                return None
+            group = m.group(1) or m.group(2)
+            if group:
+                if int(group) > self.regex.groups:
+                    return None
+                parts.append(int(group))
+            else:
+                parts.append(m.group(3) or m.group(4) or m.group(5))
+            pos = m.end()
+        return parts
+
+    def _expand(self, m):
+        if self.target_parts is None:
+            return m.expand(self.target_repl)
+        return ''.join(
+            m[part] or '' if isinstance(part, int) else part
+            for part in self.target_parts
+        )
+
     def match(self, path):
         m = self.regex.search(path)
         if m:
-            if self.target_repl:
-                return (self.code, self.regex.sub(self.target_repl, path))
-            else:
+            if not self.target_repl:
                 # A rule that doesn't have a response target, like 410.
                 return (self.code, self.target_repl)
+            if not self.anchored:
+                # The pattern may match more than once.
+                return (self.code, self.regex.sub(self.target_repl, path))
+            return (
+                self.code,
+                path[:m.start()] + self._expand(m) + path[m.end():],
+            )
         return None
 
 
+class PatternSet:
+    """Several RedirectMatch rules compiled into one regular expression.
+
+    Each pattern becomes a lookahead in a single alternation anchored
+    at the start of the path. PCRE2 tries the alternatives in order,
+    so the first one to succeed belongs to the earliest rule that
+    matches the path. The alternatives are arranged in a binary tree
+    of named, empty groups so the winner can be found by checking
+    which side of each branch was taken.
+
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._names = []
+        body = self._build(0, len(entries))
+        # (?n) turns off numbered capturing for the user patterns, so
+        # only the named branch markers capture. The combined pattern
+        # is JIT compiled if its rules are. The rules of a RuleSet
+        # share their limits, and the combined pattern does the work of
+        # all of its rules, so it gets the match limit of each of them.
+        match_limit, depth_limit = entries[0][1]._limits
+        self.regex = _compile(
+            '(?n)^(?:{})'.format(body),
+            all(rule.jit for _, rule in entries),
+            (match_limit * len(entries), depth_limit),
+        )
+        self._tree = self._resolve(0, len(entries))
+
+    @staticmethod
+    def _lookahead(rule):
+        if rule.anchored:
+            # An anchored pattern can only match at the start, so skip
+            # the scan through the rest of the path.
+            return '(?=(?:{}))'.format(rule.pattern)
+        return '(?=[\\s\\S]*?(?:{}))'.format(rule.pattern)
+
+    def _build(self, lo, hi):
+        if hi - lo == 1:
+            return self._lookahead(self.entries[lo][1])
+        mid = (lo + hi) // 2
+        name = 'whereto{}'.format(len(self._names))
+        self._names.append(name)
+        return '(?:(?<{}>{})|{})'.format(
+            name, self._build(lo, mid), self._build(mid, hi))
+
+    def _resolve(self, lo, hi):
+        # Rebuild the tree shape from _build(), replacing the group
+        # names with their numbers and the leaves with entry indexes.
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        group = self.regex.groupindex[self._names.pop(0)]
+        return (group, self._resolve(lo, mid), self._resolve(mid, hi))
+
+    def search(self, path):
+        """Return the index of the first entry matching path, or None."""
+        m = self.regex.search(path)
+        if not m:
+            return None
+        node = self._tree
+        while not isinstance(node, int):
+            group, left, right = node
+            node = left if m.start(group) != -1 else right
+        return node
+
+
+class RegexEngine:
+    """Find the RedirectMatch rules that may match a path.
+
+    Rules whose patterns can be combined are grouped into PatternSet
+    instances of up to chunk_size patterns. Rules using features that
+    do not survive being combined, like numbered back references or
+    backtracking control verbs, are tested on their own.
+
+    """
+
+    chunk_size = 128
+
+    # Patterns that refer to groups by number, including in
+    # conditionals, change how the rest of the expression is parsed,
+    # or control backtracking outside of their own alternative.
+    _uncombinable = re.compile(
+        r'\\[0-9gkKQEG]|\(\*|\(\?(?:P|&|R|C|\(|[-+]?[0-9]|[a-zA-Z^-]*x)'
+    )
+
+    def __init__(self, entries):
+        self._segments = []
+        pending = []
+        for entry in entries:
+            if self._uncombinable.search(entry[1].pattern):
+                self._add_combined(pending)
+                pending = []
+                self._segments.append(entry)
+            else:
+                pending.append(entry)
+        self._add_combined(pending)
+
+    def _add_combined(self, entries):
+        for start in range(0, len(entries), self.chunk_size):
+            self._add_chunk(entries[start:start + self.chunk_size])
+
+    def _add_chunk(self, entries):
+        if len(entries) < 2:
+            self._segments.extend(entries)
+            return
+        try:
+            self._segments.append(PatternSet(entries))
+        except Exception:
+            # The combined pattern may be too large for PCRE2, or two
+            # patterns may use the same group name. Split it up.
+            mid = len(entries) // 2
+            self._add_chunk(entries[:mid])
+            self._add_chunk(entries[mid:])
+
+    def candidates(self, path, limit):
+        """Generate (position, rule) pairs that may match path.
+
+        The pairs are produced in file order and stop before position
+        limit. Every rule that matches path is produced, along with
+        some that might not.
+
+        """
+        for segment in self._segments:
+            if not isinstance(segment, PatternSet):
+                if segment[0] >= limit:
+                    return
+                yield segment
+                continue
+            entries = segment.entries
+            if entries[0][0] >= limit:
+                return
+            try:
+                first = segment.search(path)
+            except Exception:
+                # Let the rules report their own errors.
+                first = 0
+            if first is None:
+                continue
+            for entry in entries[first:]:
+                if entry[0] >= limit:
+                    return
+                yield entry
+
+
+class PrefixTrie:
+    """RedirectMatch rules indexed by the path segments of their prefix.
+
+    A rule is stored at the node reached by following the complete
+    segments of its literal prefix, so a path only needs to be tested
+    against the rules stored along its own segments. The rules at each
+    node are matched with their own RegexEngine.
+
+    """
+
+    # There can be a node for every rule, so they do without a
+    # __dict__, and nodes without children do without the dict for
+    # them.
+    __slots__ = ('_entries', '_engine', '_children')
+
+    def __init__(self):
+        self._entries = []
+        self._engine = None
+        self._children = None
+
+    def __getstate__(self):
+        return (self._entries, self._children)
+
+    def __setstate__(self, state):
+        self._entries, self._children = state
+        self._engine = None
+
+    def add(self, entry):
+        node = self
+        for segment in entry[1].prefix.split('/')[:-1]:
+            if node._children is None:
+                node._children = {}
+            node = node._children.setdefault(segment, PrefixTrie())
+        node._entries.append(entry)
+        node._engine = None
+
+    def compile(self):
+        """Build the regex engines for every node now."""
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node._entries and node._engine is None:
+                node._engine = RegexEngine(node._entries)
+            if node._children:
+                nodes.extend(node._children.values())
+
+    def candidates(self, path, limit):
+        """Return generators of (position, rule) pairs that may match path.
+
+        Each generator produces pairs in file order. See
+        RegexEngine.candidates().
+
+        """
+        streams = []
+        node = self
+        segments = path.split('/')
+        for segment in segments:
+            if node._entries:
+                if node._engine is None:
+                    node._engine = RegexEngine(node._entries)
+                streams.append(node._engine.candidates(path, limit))
+            if not node._children:
+                break
+            node = node._children.get(segment)
+            if node is None:
+                break
+        return streams
+
+    def entries(self, path):
+        """Return the lists of (position, rule) pairs stored along path.
+
+        Like candidates(), without narrowing the rules down with the
+        regex engines.
+
+        """
+        lists = []
+        node = self
+        for segment in path.split('/'):
+            if node._entries:
+                lists.append(node._entries)
+            if not node._children:
+                break
+            node = node._children.get(segment)
+            if node is None:
+                break
+        return lists
+
+
 class RuleSet:
-    "An ordered collection of rules."
+    """An ordered collection of rules.
+
+    :param cache_size: How many match results to remember, evicting
+                       the least recently used first. 0 disables the
+                       cache.
+    :type cache_size: int
+    :param trace: Object with an append() method, like a list, that
+                  receives a (linenum, path, result) tuple for every
+                  path matched. linenum and result are None for paths
+                  no rule matched.
+    :param lazy: Compile the pattern of each RedirectMatch rule when it
+                 is first matched instead of when it is added. Errors
+                 in the patterns are then reported as failures to
+                 evaluate the rule. See precompile().
+    :type lazy: bool
+    :param jit: JIT compile the regular expressions when PCRE2 supports
+                it. Compiling takes longer but matching is faster.
+    :type jit: bool
+    :param profiler: A profiler.RuleProfiler that receives the time
+                     spent evaluating each rule. Matching is slower
+                     while it is set, and the cache is not used.
+    :param match_limit: How much backtracking a RedirectMatch pattern may
+                        do for one path before the rule is treated as
+                        not matching. 0 keeps the PCRE2 default.
+    :type match_limit: int
+    :param depth_limit: How deeply a pattern may nest while matching one
+                        path, for patterns that are not JIT compiled. 0
+                        keeps the PCRE2 default.
+    :type depth_limit: int
+
+    """
+
+    # How many patterns each task compiles in precompile().
+    precompile_chunk_size = 256
 
     _factories = {
         'redirect': Redirect,
         'redirectmatch': RedirectMatch,
     }
 
-    def __init__(self):
+    def __init__(self, cache_size=0, trace=None, lazy=False, jit=True,
+                 profiler=None, match_limit=0, depth_limit=0):
         self._rules = []
         self._by_num = {}
+        self.trace = trace
+        self.profiler = profiler
+        self.cache_size = cache_size
+        self.lazy = lazy
+        self.jit = jit
+        self.match_limit = match_limit
+        self.depth_limit = depth_limit
+        self._limits = (match_limit, depth_limit)
+        self._cache = collections.OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # How many times each rule, by line number, ran into the limits.
+        self.limit_errors = collections.Counter()
+        # Redirect rules only match when the path equals the pattern,
+        # so their positions are indexed by pattern. Only the first
+        # rule for each pattern is kept because a later one can never
+        # win.
+        # RedirectMatch rules with a literal prefix are indexed by the
+        # segments of the prefix, and the remaining rules have to be
+        # scanned in order. All of the structures record the position
+        # of the rule in the file so the first match wins regardless
+        # of which structure it comes from.
+        self._exact = {}
+        self._prefixed = PrefixTrie()
+        self._scanned = []
+        self._engine = None
+        # The evaluation plan built by optimize(): results for paths
+        # matched by often used Redirect rules, and often used
+        # RedirectMatch rules that can be tried before the others,
+        # indexed by their prefix, with the lengths of the prefixes.
+        self._hot_exact = {}
+        self._hot_patterns = {}
+        self._hot_lengths = []
+
+    def __getstate__(self):
+        # Only the rules and their indexes are worth saving. The regex
+        # engines are rebuilt when they are needed.
+        state = self.__dict__.copy()
+        state['_engine'] = None
+        state['_cache'] = collections.OrderedDict()
+        state['cache_hits'] = state['cache_misses'] = 0
+        state['limit_errors'] = collections.Counter()
+        state['trace'] = None
+        state['profiler'] = None
+        return state
 
     def add(self, linenum, *params):
         rule_type = params[0].lower()
-        rule = self._factories[rule_type](linenum, *params)
+        rule = self._factories[rule_type](
+            linenum, *params,
+            lazy=self.lazy, jit=self.jit, limits=self._limits,
+        )
+        self.add_rule(rule)
+
+    def add_rule(self, rule):
+        """Add a Rule instance after the rules already in the set."""
+        position = len(self._rules)
         self._rules.append(rule)
-        self._by_num[linenum] = rule
+        if self._cache:
+            self._cache.clear()
+        if self._hot_exact or self._hot_lengths:
+            self._hot_exact = {}
+            self._hot_patterns = {}
+            self._hot_lengths = []
+        self._by_num[rule.linenum] = rule
+        if isinstance(rule, Redirect):
+            self._exact.setdefault(rule.pattern, position)
+        elif rule.prefix:
+            self._prefixed.add((position, rule))
+        else:
+            self._scanned.append((position, rule))
+            self._engine = None
+
+    def optimize(self, hits, max_patterns=1000):
+        """Check the most used rules first where that gives the same result.
+
+        A rule can be checked before the rules above it only if none of
+        them can match a path it matches, so the rules still produce
+        the first match in file order. Redirect rules that are the
+        first match for their own path have their result looked up
+        directly. RedirectMatch rules qualify when their literal prefix
+        shows that every earlier rule matches different paths, and up
+        to max_patterns of the most used ones are tried before the
+        other rules. The plan is dropped when a rule is added.
+
+        :param hits: Mapping of rule line numbers to how often the
+                     rule matched, like the counts from whereto-replay.
+        :type hits: dict
+        :param max_patterns: How many RedirectMatch rules to try first.
+        :type max_patterns: int
+
+        """
+        self._hot_exact = {}
+        self._hot_patterns = {}
+        self._hot_lengths = []
+        self._cache.clear()
+        positions = {
+            rule.linenum: position
+            for position, rule in enumerate(self._rules)
+        }
+        ranked = sorted(
+            (n for n in hits if hits[n] and n in positions),
+            key=lambda n: (-hits[n], positions[n]),
+        )
+        hot_exact = {}
+        candidates = []
+        for linenum in ranked:
+            rule = self._by_num[linenum]
+            if isinstance(rule, Redirect):
+                if self._rules[self._exact[rule.pattern]] is not rule:
+                    continue
+                m = self._match(rule.pattern)
+                if m is not None and m[0] == linenum:
+                    hot_exact[rule.pattern] = m
+            elif rule.prefix and len(candidates) < max_patterns:
+                candidates.append((positions[linenum], rule))
+        # None of the rules left share a prefix or have a prefix that
+        # starts with another one's, so at most one of them can match
+        # a path.
+        hot_patterns = {
+            rule.prefix: rule
+            for rule in self._disjoint_from_earlier(candidates)
+        }
+        self._hot_lengths = sorted({len(p) for p in hot_patterns})
+        self._hot_patterns = hot_patterns
+        self._hot_exact = hot_exact
+
+    def _disjoint_from_earlier(self, candidates):
+        # Return the rules from candidates that cannot match the same
+        # path as any rule before them. A RedirectMatch rule with a
+        # prefix only matches paths starting with it, so it is
+        # disjoint from an earlier rule with a prefix when neither
+        # prefix starts with the other, and from an earlier Redirect
+        # when it does not match that Redirect's path. Rules without a
+        # prefix could match anything.
+        first_scanned = self._scanned[0][0] if self._scanned else None
+        prefixes = []
+        first_with_prefix = {}
+        paths = []
+        for position, rule in enumerate(self._rules):
+            if isinstance(rule, Redirect):
+                paths.append((rule.pattern, position))
+            elif rule.prefix:
+                prefixes.append((rule.prefix, position))
+                first_with_prefix.setdefault(rule.prefix, position)
+        prefixes.sort()
+        paths.sort()
+
+        def starting_with(items, prefix):
+            i = bisect.bisect_left(items, (prefix,))
+            while i < len(items) and items[i][0].startswith(prefix):
+                yield items[i]
+                i += 1
+
+        safe = []
+        for position, rule in candidates:
+            prefix = rule.prefix
+            if first_scanned is not None and first_scanned < position:
+                continue
+            if any(first_with_prefix.get(prefix[:i], position) < position
+                   for i in range(1, len(prefix) + 1)):
+                continue
+            if any(p < position for _, p in starting_with(prefixes, prefix)):
+                continue
+            if any(p < position and self._evaluate(rule, path) is not None
+                   for path, p in starting_with(paths, prefix)):
+                continue
+            safe.append(rule)
+        return safe
+
+    def compile(self):
+        """Build the regex engines now instead of on first use.
+
+        This keeps the cost of combining the patterns out of the first
+        lookups, for example when preparing a RuleSet in the
+        background before it starts serving requests.
+
+        """
+        self._prefixed.compile()
+        if self._engine is None:
+            self._engine = RegexEngine(self._scanned)
+
+    @staticmethod
+    def _compile_rules(rules):
+        compiled = 0
+        errors = []
+        for rule in rules:
+            try:
+                if rule.compile():
+                    compiled += 1
+            except Exception as e:
+                errors.append((rule.linenum, str(e)))
+        return (compiled, errors)
+
+    def precompile(self, linenums=None, workers=1):
+        """Compile the patterns of RedirectMatch rules now.
+
+        In a lazy RuleSet, this warms the rules expected to be used, or
+        checks every pattern at once, without paying for it when the
+        RuleSet is created.
+
+        Returns a dict with the number of patterns compiled by this
+        call, the number that were already compiled, the errors as
+        (linenum, message) tuples, and the elapsed seconds.
+
+        :param linenums: Line numbers of the rules to compile, or None
+                         for every rule. Other kinds of rules are
+                         skipped.
+        :param workers: How many threads compile the patterns. More
+                        than 1 only helps if the regex library releases
+                        the GIL while compiling.
+        :type workers: int
+
+        """
+        start = time.perf_counter()
+        if linenums is None:
+            selected = self._rules
+        else:
+            selected = (
+                self._by_num[n] for n in linenums if n in self._by_num
+            )
+        pending = []
+        already = 0
+        for rule in selected:
+            if not isinstance(rule, RedirectMatch):
+                continue
+            if rule._regex is None:
+                pending.append(rule)
+            else:
+                already += 1
+        size = self.precompile_chunk_size
+        chunks = [
+            pending[i:i + size] for i in range(0, len(pending), size)
+        ]
+        if workers > 1 and len(chunks) > 1:
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(self._compile_rules, chunks))
+        else:
+            results = [self._compile_rules(chunk) for chunk in chunks]
+        compiled = 0
+        errors = []
+        for chunk_compiled, chunk_errors in results:
+            compiled += chunk_compiled
+            errors.extend(chunk_errors)
+        return {
+            'compiled': compiled,
+            'already_compiled': already,
+            'errors': errors,
+            'seconds': time.perf_counter() - start,
+        }
 
     def __getitem__(self, index):
         return self._by_num[index]
@@ -121,16 +855,158 @@ class RuleSet:
     def all_ids(self):
         return list(self._by_num.keys())
 
+    def _evaluate(self, rule, path):
+        try:
+            m = rule.match(path)
+        except Exception as e:
+            if exceeded_limit(e):
+                self.limit_errors[rule.linenum] += 1
+            LOG.warning('Failed to evaluate %s against %s: %s',
+                        rule, path, e)
+            return None
+        if m is not None:
+            # The arguments are only formatted if debug logging is on.
+            LOG.debug('Matched "%s" for path "%s" producing %s',
+                      rule, path, m)
+            return (rule.linenum,) + m
+        return None
+
+    def _profiled_evaluate(self, rule, path):
+        start = time.perf_counter()
+        try:
+            m = rule.match(path)
+        except Exception as e:
+            self.profiler.record(
+                rule.linenum, path, time.perf_counter() - start, False,
+                error=True)
+            if exceeded_limit(e):
+                self.limit_errors[rule.linenum] += 1
+            LOG.warning('Failed to evaluate %s against %s: %s',
+                        rule, path, e)
+            return None
+        self.profiler.record(
+            rule.linenum, path, time.perf_counter() - start, m is not None)
+        if m is not None:
+            return (rule.linenum,) + m
+        return None
+
+    def _profiled_match(self, path):
+        # Each rule that may match is evaluated on its own, without the
+        # combined patterns or the plan from optimize(), so the time
+        # spent in every pattern is known. The result is the same.
+        self.profiler.paths += 1
+        exact = self._exact.get(path)
+        if exact is not None:
+            limit = exact
+        else:
+            limit = len(self._rules)
+        lists = self._prefixed.entries(path)
+        lists.append(self._scanned)
+        for position, rule in heapq.merge(*lists):
+            if position >= limit:
+                break
+            m = self._profiled_evaluate(rule, path)
+            if m is not None:
+                return m
+        if exact is not None:
+            return self._profiled_evaluate(self._rules[exact], path)
+        return None
+
     def match(self, path):
-        for rule in self:
-            try:
-                m = rule.match(path)
-            except Exception as e:
-                LOG.warning('Failed to evaluate {} against {}: {}'.format(
-                    rule, path, e))
+        if self.profiler is not None:
+            result = self._profiled_match(path)
+        elif not self.cache_size:
+            result = self._match(path)
+        else:
+            result = self._cached_match(path)
+        if self.trace is not None:
+            if result is None:
+                self.trace.append((None, path, None))
             else:
+                self.trace.append((result[0], path, result[1:]))
+        return result
+
+    def match_many(self, paths):
+        """Return the result of match() for each path, in order.
+
+        Each distinct path is only matched once, however many times it
+        appears in paths, which makes this cheaper than calling match()
+        for each path when matching batches with repeated paths, like
+        the requests in an access log. The trace receives a record for
+        every path, as if match() was called for each one.
+
+        :param paths: Iterable of paths.
+
+        """
+        if self.profiler is not None:
+            match = self._profiled_match
+        elif self.cache_size:
+            match = self._cached_match
+        else:
+            match = self._match
+        trace = self.trace
+        seen = {}
+        results = []
+        for path in paths:
+            try:
+                result = seen[path]
+            except KeyError:
+                result = seen[path] = match(path)
+            results.append(result)
+            if trace is not None:
+                if result is None:
+                    trace.append((None, path, None))
+                else:
+                    trace.append((result[0], path, result[1:]))
+        return results
+
+    def _cached_match(self, path):
+        try:
+            result = self._cache[path]
+        except KeyError:
+            self.cache_misses += 1
+            result = self._match(path)
+            self._cache[path] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self.cache_hits += 1
+            try:
+                self._cache.move_to_end(path)
+            except KeyError:
+                # Evicted by another thread since it was found.
+                pass
+        return result
+
+    def _match(self, path):
+        if self._hot_exact:
+            hot = self._hot_exact.get(path)
+            if hot is not None:
+                return hot
+        for length in self._hot_lengths:
+            rule = self._hot_patterns.get(path[:length])
+            if rule is not None:
+                m = self._evaluate(rule, path)
                 if m is not None:
-                    LOG.debug(
-                        'Matched "{}" for path "{}" producing {}'.format(
-                            rule, path, m))
-                    return (rule.linenum,) + m
+                    return m
+                break
+        exact = self._exact.get(path)
+        if exact is not None:
+            limit = exact
+        else:
+            limit = len(self._rules)
+        if self._engine is None:
+            self._engine = RegexEngine(self._scanned)
+        streams = self._prefixed.candidates(path, limit)
+        if streams:
+            streams.append(self._engine.candidates(path, limit))
+            candidates = heapq.merge(*streams)
+        else:
+            candidates = self._engine.candidates(path, limit)
+        for position, rule in candidates:
+            m = self._evaluate(rule, path)
+            if m is not None:
+                return m
+        if exact is not None:
+            return self._evaluate(self._rules[exact], path)
+        return None
@@ -0,0 +1,290 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import http
+import logging
+import socketserver
+import sys
+import urllib.parse
+from wsgiref import simple_server
+
+from whereto import loader
+from whereto import reloader
+from whereto import replay
+
+
+LOG = logging.getLogger()
+
+# Characters left alone when encoding a Location header: the reserved
+# characters of a URL, and % so targets that are already encoded stay
+# the same.
+_location_safe = "/:?#[]@!$&'()*+,;=%~"
+
+# The status keywords Apache accepts in place of a code.
+_status_keywords = {
+    'permanent': '301',
+    'temp': '302',
+    'seeother': '303',
+    'gone': '410',
+}
+
+
+def redirect_response(ruleset, path, query=''):
+    """Return the response for a request as (status, headers, body).
+
+    status is an http.HTTPStatus and headers is a list of (name, value) tuples.
+    Paths matching a rule with a target get a Location header, and
+    the query string is passed on unless the target has its own. The
+    Location is percent-encoded, since the target is built from the
+    decoded path. Paths matching a rule without a target, like 410,
+    get just the status, and paths matching no rule get 404. Apache's
+    status keywords, like permanent, are accepted, and a rule whose
+    code is not an HTTP status produces a 500.
+
+    """
+    match = ruleset.match(path)
+    headers = []
+    if match is None:
+        status = http.HTTPStatus.NOT_FOUND
+    else:
+        linenum, code, target = match
+        code = _status_keywords.get(code.lower(), code)
+        try:
+            status = http.HTTPStatus(int(code))
+        except ValueError:
+            LOG.error('Rule on line %s has an invalid status code %r',
+                      linenum, code)
+            status = http.HTTPStatus.INTERNAL_SERVER_ERROR
+            target = None
+        if target is not None:
+            if query and '?' not in target:
+                target = '{}?{}'.format(target, query)
+            headers.append((
+                'Location',
+                urllib.parse.quote(target, safe=_location_safe),
+            ))
+    body = '{} {}\n'.format(status.value, status.phrase).encode('utf-8')
+    headers.append(('Content-Type', 'text/plain; charset=utf-8'))
+    headers.append(('Content-Length', str(len(body))))
+    return (status, headers, body)
+
+
+class WSGIApplication:
+    """A WSGI application serving the redirects in a RuleSet.
+
+    The rules are read from the ruleset attribute on every request,
+    so it can be replaced while the application is running.
+
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+
+    """
+
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+
+    def __call__(self, environ, start_response):
+        # WSGI passes the path as latin-1 decoded bytes.
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        path = path.encode('latin-1').decode('utf-8', 'replace')
+        status, headers, body = redirect_response(
+            self.ruleset,
+            path,
+            environ.get('QUERY_STRING', ''),
+        )
+        start_response(
+            '{} {}'.format(status.value, status.phrase),
+            headers,
+        )
+        return [body]
+
+
+class ASGIApplication:
+    """An ASGI application serving the redirects in a RuleSet.
+
+    The rules are read from the ruleset attribute on every request,
+    so it can be replaced while the application is running.
+
+    :param ruleset: The redirect rules.
+    :type ruleset: RuleSet
+
+    """
+
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            raise ValueError(
+                'Unsupported ASGI scope type {}'.format(scope['type']))
+        # The ASGI spec has the path include root_path, but older
+        # servers leave the mount point out of it.
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if not path.startswith(root_path):
+            path = root_path + path
+        status, headers, body = redirect_response(
+            self.ruleset,
+            path,
+            scope.get('query_string', b'').decode('latin-1'),
+        )
+        await send({
+            'type': 'http.response.start',
+            'status': status.value,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': body,
+        })
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn,
+                           simple_server.WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        LOG.debug(format, *args)
+
+
+argument_parser = argparse.ArgumentParser(
+    description='Serve the redirects in a rules file over HTTP.',
+)
+argument_parser.add_argument(
+    '--host',
+    default='127.0.0.1',
+    help='address to listen on',
+)
+argument_parser.add_argument(
+    '-p', '--port',
+    type=int,
+    default=8080,
+    help='port to listen on',
+)
+argument_parser.add_argument(
+    '--cache-size',
+    type=int,
+    default=10000,
+    help='how many rule match results to cache',
+)
+argument_parser.add_argument(
+    '--rules-cache',
+    metavar='DIR',
+    help='directory for saving parsed rules to reuse in later runs',
+)
+argument_parser.add_argument(
+    '--hit-counts',
+    metavar='FILE',
+    help='report from whereto-replay used to check the most used rules '
+    'first',
+)
+argument_parser.add_argument(
+    '--match-limit',
+    type=int,
+    default=100000,
+    metavar='N',
+    help='treat a RedirectMatch rule as not matching a path when PCRE2 '
+    'needs more than N backtracking steps, 0 for the PCRE2 default',
+)
+argument_parser.add_argument(
+    '--depth-limit',
+    type=int,
+    default=0,
+    metavar='N',
+    help='limit how deeply PCRE2 may nest while matching a pattern that '
+    'is not JIT compiled, 0 for the PCRE2 default',
+)
+argument_parser.add_argument(
+    '--reload-interval',
+    type=float,
+    default=0,
+    metavar='SECONDS',
+    help='check the rules file for changes this often and load the new '
+    'rules without restarting, 0 to never check',
+)
+argument_parser.add_argument(
+    '-v', '--verbose',
+    action='store_true',
+    default=False,
+    help='log every request',
+)
+argument_parser.add_argument(
+    'htaccess_file',
+    help='file with rewrite rules',
+)
+
+
+def main():
+    args = argument_parser.parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='whereto-serve %(levelname)s: %(message)s',
+        stream=sys.stdout,
+    )
+    ruleset = loader.load_ruleset(
+        args.htaccess_file,
+        cache_dir=args.rules_cache,
+        cache_size=args.cache_size,
+        match_limit=args.match_limit,
+        depth_limit=args.depth_limit,
+    )
+    LOG.info('loaded %d rules from %s',
+             len(ruleset.all_ids), args.htaccess_file)
+    hits = None
+    if args.hit_counts:
+        hits = replay.load_hit_counts(args.hit_counts)
+        ruleset.optimize(hits)
+    application = WSGIApplication(ruleset)
+    watcher = None
+    if args.reload_interval > 0:
+        watcher = reloader.Reloader(
+            args.htaccess_file,
+            application,
+            interval=args.reload_interval,
+            cache_size=args.cache_size,
+            hits=hits,
+            match_limit=args.match_limit,
+            depth_limit=args.depth_limit,
+        )
+        watcher.start()
+    server = simple_server.make_server(
+        args.host,
+        args.port,
+        application,
+        server_class=_ThreadingWSGIServer,
+        handler_class=_QuietHandler,
+    )
+    LOG.info('serving on http://%s:%d/', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        server.server_close()
+    return 0
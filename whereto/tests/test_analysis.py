@@ -0,0 +1,199 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fixtures
+
+from whereto import analysis
+from whereto import rules
+from whereto.tests import base
+
+
+class TestRuleTarget(base.TestCase):
+
+    def test_redirect(self):
+        rule = rules.Redirect(1, 'redirect', '301', '/a', '/b')
+        self.assertEqual('/b', analysis.rule_target(rule))
+
+    def test_410(self):
+        rule = rules.Redirect(1, 'redirect', '410', '/a', None)
+        self.assertIsNone(analysis.rule_target(rule))
+
+    def test_redirectmatch_literal(self):
+        rule = rules.RedirectMatch(
+            1, 'redirectmatch', '301', '^/a/.*$', '/b/\\$x',
+        )
+        self.assertEqual('/b/$x', analysis.rule_target(rule))
+
+    def test_redirectmatch_group(self):
+        rule = rules.RedirectMatch(
+            1, 'redirectmatch', '301', '^/a/(.*)$', '/b/$1',
+        )
+        self.assertIsNone(analysis.rule_target(rule))
+
+    def test_redirectmatch_partial(self):
+        rule = rules.RedirectMatch(
+            1, 'redirectmatch', '301', '^/a/', '/b/',
+        )
+        self.assertIsNone(analysis.rule_target(rule))
+
+
+class TestRuleTargetLazy(base.TestCase):
+
+    def test_invalid_pattern(self):
+        logger = self.useFixture(fixtures.FakeLogger())
+        ruleset = rules.RuleSet(lazy=True)
+        ruleset.add(1, 'redirectmatch', '301', '^/x(/.*$', '/y$1')
+        self.assertIsNone(analysis.rule_target(ruleset[1]))
+        self.assertIn('Failed to compile [1]', logger.output)
+
+
+class TestFindChains(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+
+    def find(self, max_hops=0):
+        graph = analysis.build_graph(self.ruleset)
+        return analysis.find_chains(graph, max_hops)
+
+    def test_build_graph(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirectmatch', '301', '^/b$', '/c')
+        self.ruleset.add(3, 'redirect', '410', '/c', None)
+        self.ruleset.add(4, 'redirectmatch', '301', '^/d/(.*)$', '/a/$1')
+        self.assertEqual(
+            {1: 2, 2: 3, 3: None, 4: None},
+            analysis.build_graph(self.ruleset),
+        )
+
+    def test_no_problems(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.assertEqual(([], []), self.find(max_hops=2))
+
+    def test_cycle(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.ruleset.add(3, 'redirect', '301', '/c', '/b')
+        self.ruleset.add(4, 'redirect', '301', '/d', '/d')
+        self.assertEqual(([[2, 3], [4]], []), self.find())
+
+    def test_long_chain(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.ruleset.add(3, 'redirect', '301', '/c', '/d')
+        self.ruleset.add(4, 'redirect', '301', '/x', '/c')
+        self.assertEqual(([], [[1, 2, 3]]), self.find(max_hops=2))
+
+    def test_long_chain_ignored_without_max_hops(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.ruleset.add(3, 'redirect', '301', '/c', '/d')
+        self.assertEqual(([], []), self.find())
+
+    def test_chain_into_cycle(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.ruleset.add(3, 'redirect', '301', '/c', '/b')
+        self.assertEqual(([[2, 3]], []), self.find(max_hops=1))
+
+
+class TestFindUnreachable(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+
+    def test_none(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirectmatch', '301', '^/c/.*$', '/d')
+        self.assertEqual([], analysis.find_unreachable(self.ruleset))
+
+    def test_duplicate_redirect(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/a', '/c')
+        self.assertEqual(
+            [(2, 1, 'duplicate')],
+            analysis.find_unreachable(self.ruleset),
+        )
+
+    def test_duplicate_redirectmatch(self):
+        self.ruleset.add(1, 'redirectmatch', '301', '^/a/.*$', '/b')
+        self.ruleset.add(2, 'redirectmatch', '301', '^/a/.*$', '/c')
+        self.assertEqual(
+            [(2, 1, 'duplicate')],
+            analysis.find_unreachable(self.ruleset),
+        )
+
+    def test_shadowed(self):
+        self.ruleset.add(1, 'redirectmatch', '301', '^/a/.*$', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/a/c', '/d')
+        self.ruleset.add(3, 'redirect', '301', '/e/c', '/d')
+        self.assertEqual(
+            [(2, 1, 'shadowed')],
+            analysis.find_unreachable(self.ruleset),
+        )
+
+    def test_same_pattern_different_kind(self):
+        self.ruleset.add(1, 'redirectmatch', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/a', '/d')
+        self.assertEqual(
+            [(2, 1, 'shadowed')],
+            analysis.find_unreachable(self.ruleset),
+        )
+
+
+class TestNestedQuantifier(base.TestCase):
+
+    def test_nested(self):
+        for pattern, group in [
+                ('^/(a+)+$', '(a+)+'),
+                ('^/(?:x*y?)*z', '(?:x*y?)*'),
+                ('^/([a-z]+/)*x', '([a-z]+/)*'),
+                ('^/((a+)b){2,}', '((a+)b){2,}'),
+                ('^/((a+)b){1,3}', '((a+)b){1,3}'),
+                ('^/((?:a|b)*c)*', '((?:a|b)*c)*'),
+                ('^/([[:alpha:]]+)+', '([[:alpha:]]+)+'),
+                ('^/(\\(+)+', '(\\(+)+'),
+        ]:
+            self.assertEqual(group, analysis.nested_quantifier(pattern))
+
+    def test_not_nested(self):
+        for pattern in [
+                '^/a/(.*)$',
+                '^/(.*)/(.*)$',
+                '^/(a+)?',
+                '^/((a+)b){1}',
+                '^/(a{2})+',
+                '^/[(+]+(a)',
+                '^/x{a}',
+                '(*UTF)^/(a|b)*',
+                '^/(?#(a+)+)a',
+                '^/\\Q(a+)+\\E',
+        ]:
+            self.assertIsNone(analysis.nested_quantifier(pattern))
+
+    def test_no_backtracking(self):
+        self.assertIsNone(analysis.nested_quantifier('^/(?>a+)+'))
+        self.assertIsNone(analysis.nested_quantifier('^/(a+)++'))
+        self.assertIsNone(analysis.nested_quantifier('^/(a++)+'))
+
+    def test_find(self):
+        ruleset = rules.RuleSet()
+        ruleset.add(1, 'redirect', '301', '/(a+)+', '/b')
+        ruleset.add(2, 'redirectmatch', '301', '^/c/(.*)$', '/d/$1')
+        ruleset.add(3, 'redirectmatch', '301', '^/(\\w+-?)+$', '/e')
+        self.assertEqual(
+            [(3, '(\\w+-?)+')],
+            analysis.find_nested_quantifiers(ruleset),
+        )
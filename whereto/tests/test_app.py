@@ -10,6 +10,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import io
+
 from whereto import app
 from whereto import rules
 from whereto.tests import base
@@ -202,3 +204,89 @@ class TestProcessTests(base.TestCase):
             {1},
         )
         self.assertEqual(expected, actual)
+
+
+class TestCheckTests(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+        self.ruleset.add(
+            1,
+            'redirect', '301', '/path', '/new/path',
+        )
+
+    def test_failures(self):
+        used = set()
+        actual = list(app.check_tests(
+            self.ruleset,
+            [(1, '/path', '301', '/new/path'),
+             (2, '/other', '301', '/new/path')],
+            0,
+            used,
+        ))
+        self.assertEqual(
+            [(app.MISMATCH, (2, '/other', '301', '/new/path'), [])],
+            actual,
+        )
+        self.assertEqual({1}, used)
+
+    def test_lazy(self):
+        def tests():
+            yield (1, '/other', '301', '/new/path')
+            raise AssertionError('read too many tests')
+
+        failures = app.check_tests(self.ruleset, tests(), 0, set())
+        self.assertEqual(
+            (app.MISMATCH, (1, '/other', '301', '/new/path'), []),
+            next(failures),
+        )
+
+
+class TestProcessTestsParallel(base.TestCase):
+
+    def test_same_as_serial(self):
+        ruleset = rules.RuleSet()
+        ruleset.add(1, 'redirect', '301', '/a', '/b')
+        ruleset.add(2, 'redirect', '301', '/b', '/a')
+        ruleset.add(3, 'redirectmatch', '301', '^/c/(.*)$', '/d/$1')
+        ruleset.add(4, 'redirect', '301', '/unused', '/d')
+        tests = []
+        for n in range(0, 200, 4):
+            tests.extend([
+                (n + 1, '/a', '301', '/b'),
+                (n + 2, '/c/{}'.format(n), '301', '/d/{}'.format(n)),
+                (n + 3, '/c/{}'.format(n), '301', '/wrong'),
+                (n + 4, '/none', '301', '/wrong'),
+            ])
+        self.assertEqual(
+            app.process_tests(ruleset, tests, 0),
+            app.process_tests(ruleset, tests, 0, jobs=3),
+        )
+
+    def test_limit_errors(self):
+        ruleset = rules.RuleSet(match_limit=1000)
+        ruleset.add(1, 'redirectmatch', '301', '^/(?:a|(?:a)+)+$', '/b')
+        ruleset.add(2, 'redirect', '301', '/c', '/d')
+        tests = []
+        for n in range(1, 1500):
+            tests.append((n, '/' + 'a' * 20 + str(n), '301', '/wrong'))
+        tests.append((1500, '/c', '301', '/d'))
+        app.process_tests(ruleset, tests, 0, jobs=2)
+        self.assertEqual({1: 1499}, dict(ruleset.limit_errors))
+
+
+class TestTraceFile(base.TestCase):
+
+    def test_append(self):
+        fd = io.StringIO()
+        trace = app.TraceFile(fd)
+        trace.append((1, '/path', ('301', '/new/path')))
+        trace.append((2, '/gone', ('410', None)))
+        trace.append((None, '/other', None))
+        self.assertEqual(
+            '1\t/path\t301\t/new/path\n'
+            '2\t/gone\t410\t-\n'
+            '-\t/other\t-\t-\n',
+            fd.getvalue(),
+        )
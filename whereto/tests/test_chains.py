@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from whereto import chains
+from whereto import rules
+from whereto.tests import base
+
+
+class TestChainResolver(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+        self.resolver = chains.ChainResolver(self.ruleset)
+
+    def test_no_match(self):
+        self.assertEqual([], self.resolver.resolve('/path'))
+
+    def test_chain(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.ruleset.add(3, 'redirect', '410', '/c', None)
+        self.assertEqual(
+            [(1, '301', '/b'), (2, '301', '/c'), (3, '410', None)],
+            self.resolver.resolve('/a'),
+        )
+
+    def test_cycle(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/a')
+        self.assertEqual(
+            [(1, '301', '/b'), (2, '301', '/a'), (1, '301', '/b')],
+            self.resolver.resolve('/a'),
+        )
+        self.assertEqual(
+            [(2, '301', '/a'), (1, '301', '/b'), (2, '301', '/a')],
+            self.resolver.resolve('/b'),
+        )
+
+    def test_max_chain(self):
+        for n in range(10):
+            self.ruleset.add(
+                n + 1,
+                'redirect', '301', '/{}'.format(n), '/{}'.format(n + 1),
+            )
+        self.assertEqual(
+            [(n + 1, '301', '/{}'.format(n + 1)) for n in range(5)],
+            self.resolver.resolve('/0'),
+        )
+
+    def test_reuse_tail(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/c')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.ruleset.add(3, 'redirect', '301', '/c', '/d')
+        self.ruleset.add(4, 'redirect', '301', '/d', '/e')
+        self.resolver.resolve('/a')
+        with mock.patch.object(self.ruleset, 'match') as match:
+            match.return_value = (2, '301', '/c')
+            self.assertEqual(
+                [(2, '301', '/c'), (3, '301', '/d'), (4, '301', '/e')],
+                self.resolver.resolve('/b'),
+            )
+        match.assert_called_once_with('/b')
+
+    def test_tail_cycle_to_start(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '301', '/b', '/c')
+        self.ruleset.add(3, 'redirect', '301', '/c', '/a')
+        self.resolver.resolve('/b')
+        self.assertEqual(
+            [(1, '301', '/b'), (2, '301', '/c'), (3, '301', '/a'),
+             (1, '301', '/b')],
+            self.resolver.resolve('/a'),
+        )
+
+    def test_max_paths(self):
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        resolver = chains.ChainResolver(self.ruleset, max_paths=1)
+        resolver.resolve('/a')
+        resolver.resolve('/c')
+        self.assertEqual(1, len(resolver._hops))
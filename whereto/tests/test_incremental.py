@@ -0,0 +1,204 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import fixtures
+
+from whereto import incremental
+from whereto import rules
+from whereto.tests import base
+
+
+def _ruleset(*lines):
+    ruleset = rules.RuleSet()
+    for linenum, params in enumerate(lines, 1):
+        if params:
+            ruleset.add(linenum, *params)
+    return ruleset
+
+
+class TestMapRules(base.TestCase):
+
+    def test_unchanged(self):
+        self.assertEqual(
+            {0: 0, 1: 1, 2: 2},
+            incremental.map_rules(['a', 'b', 'c'], ['a', 'b', 'c']),
+        )
+
+    def test_insert(self):
+        self.assertEqual(
+            {0: 0, 1: 2, 2: 3},
+            incremental.map_rules(['a', 'b', 'c'], ['a', 'x', 'b', 'c']),
+        )
+
+    def test_remove(self):
+        self.assertEqual(
+            {0: 0, 2: 1},
+            incremental.map_rules(['a', 'b', 'c'], ['a', 'c']),
+        )
+
+    def test_change(self):
+        self.assertEqual(
+            {0: 0, 2: 2},
+            incremental.map_rules(['a', 'b', 'c'], ['a', 'x', 'c']),
+        )
+
+    def test_move(self):
+        mapping = incremental.map_rules(
+            ['a', 'b', 'c', 'd'], ['a', 'c', 'd', 'b'])
+        self.assertEqual({0: 0, 2: 1, 3: 2}, mapping)
+
+    def test_duplicates(self):
+        self.assertEqual(
+            {0: 0, 1: 2, 2: 3},
+            incremental.map_rules(['a', 'a', 'a'], ['a', 'b', 'a', 'a']),
+        )
+
+
+class TestIncrementalResolver(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old = _ruleset(
+            ('redirect', '301', '/a', '/b'),
+            ('redirect', '301', '/b', '/c'),
+            ('redirectmatch', '301', '^/d/(.*)$', '/e/$1'),
+        )
+        self.state = self._run(self.old, ['/a', '/d/x', '/nothing'])
+
+    def _run(self, ruleset, paths):
+        resolver = incremental.IncrementalResolver(ruleset)
+        for path in paths:
+            resolver.resolve(path)
+        return {
+            'format': incremental.STATE_FORMAT,
+            'rules': [
+                [r.linenum] + list(incremental.rule_key(r))
+                for r in ruleset
+            ],
+            'chains': resolver.chains,
+        }
+
+    def test_no_state(self):
+        resolver = incremental.IncrementalResolver(self.old)
+        self.assertEqual(
+            [(1, '301', '/b'), (2, '301', '/c')],
+            resolver.resolve('/a'),
+        )
+        self.assertEqual(1, resolver.evaluated)
+        self.assertEqual(0, resolver.reused)
+
+    def test_reuse_with_new_line_numbers(self):
+        new = _ruleset(
+            None,
+            ('redirect', '301', '/a', '/b'),
+            ('redirect', '301', '/b', '/c'),
+            ('redirectmatch', '301', '^/d/(.*)$', '/e/$1'),
+        )
+        resolver = incremental.IncrementalResolver(new, self.state)
+        self.assertEqual(
+            [(2, '301', '/b'), (3, '301', '/c')],
+            resolver.resolve('/a'),
+        )
+        self.assertEqual([(4, '301', '/e/x')], resolver.resolve('/d/x'))
+        self.assertEqual([], resolver.resolve('/nothing'))
+        self.assertEqual(3, resolver.reused)
+        self.assertEqual(0, resolver.evaluated)
+
+    def test_changed_rule(self):
+        new = _ruleset(
+            ('redirect', '301', '/a', '/b'),
+            ('redirect', '301', '/b', '/z'),
+            ('redirectmatch', '301', '^/d/(.*)$', '/e/$1'),
+        )
+        resolver = incremental.IncrementalResolver(new, self.state)
+        self.assertEqual(
+            [(1, '301', '/b'), (2, '301', '/z')],
+            resolver.resolve('/a'),
+        )
+        self.assertEqual([(3, '301', '/e/x')], resolver.resolve('/d/x'))
+        self.assertEqual(1, resolver.evaluated)
+
+    def test_removed_rule(self):
+        new = _ruleset(
+            ('redirect', '301', '/a', '/b'),
+            ('redirectmatch', '301', '^/d/(.*)$', '/e/$1'),
+        )
+        resolver = incremental.IncrementalResolver(new, self.state)
+        self.assertEqual([(1, '301', '/b')], resolver.resolve('/a'))
+        self.assertEqual(1, resolver.evaluated)
+
+    def test_added_rule_matches_path(self):
+        new = _ruleset(
+            ('redirectmatch', '410', '^/nothing'),
+            ('redirect', '301', '/a', '/b'),
+            ('redirect', '301', '/b', '/c'),
+            ('redirectmatch', '301', '^/d/(.*)$', '/e/$1'),
+        )
+        resolver = incremental.IncrementalResolver(new, self.state)
+        self.assertEqual([(1, '410', None)], resolver.resolve('/nothing'))
+        self.assertEqual(
+            [(2, '301', '/b'), (3, '301', '/c')],
+            resolver.resolve('/a'),
+        )
+        self.assertEqual(1, resolver.evaluated)
+
+    def test_added_rule_matches_chain(self):
+        new = _ruleset(
+            ('redirect', '301', '/a', '/b'),
+            ('redirect', '301', '/c', '/a'),
+            ('redirect', '301', '/b', '/c'),
+            ('redirectmatch', '301', '^/d/(.*)$', '/e/$1'),
+        )
+        resolver = incremental.IncrementalResolver(new, self.state)
+        self.assertEqual(
+            [(1, '301', '/b'), (3, '301', '/c'), (2, '301', '/a'),
+             (1, '301', '/b')],
+            resolver.resolve('/a'),
+        )
+        self.assertEqual(1, resolver.evaluated)
+
+
+class TestState(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.logger = self.useFixture(fixtures.FakeLogger())
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(tmpdir, 'state.json')
+
+    def test_round_trip(self):
+        ruleset = _ruleset(('redirect', '301', '/a', '/b'))
+        resolver = incremental.IncrementalResolver(ruleset)
+        resolver.resolve('/a')
+        incremental.save_state(self.filename, ruleset, resolver)
+        state = incremental.load_state(self.filename)
+        resolver = incremental.IncrementalResolver(ruleset, state)
+        self.assertEqual([(1, '301', '/b')], resolver.resolve('/a'))
+        self.assertEqual(1, resolver.reused)
+
+    def test_missing(self):
+        self.assertIsNone(incremental.load_state(self.filename))
+        self.assertEqual('', self.logger.output)
+
+    def test_unreadable(self):
+        with open(self.filename, 'w') as f:
+            f.write('{not json')
+        self.assertIsNone(incremental.load_state(self.filename))
+        self.assertIn('Ignoring unreadable state file', self.logger.output)
+
+    def test_other_format(self):
+        with open(self.filename, 'w') as f:
+            f.write('{"format": 0}')
+        self.assertIsNone(incremental.load_state(self.filename))
+        self.assertIn('from another version', self.logger.output)
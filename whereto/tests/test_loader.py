@@ -0,0 +1,131 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+from unittest import mock
+
+import fixtures
+import pcre2
+
+from whereto import loader
+from whereto.tests import base
+
+
+RULES = b'''
+redirect 301 /path /new/path
+redirectmatch 301 ^/regex/(.*)$ /new/regex/$1
+'''
+
+
+class TestLoadRuleset(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(self.tempdir, 'htaccess')
+        with open(self.filename, 'wb') as f:
+            f.write(RULES)
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+
+    def assertRules(self, ruleset):
+        self.assertEqual([2, 3], ruleset.all_ids)
+        self.assertEqual(
+            (3, '301', '/new/regex/foo'),
+            ruleset.match('/regex/foo'),
+        )
+
+    def test_no_cache(self):
+        self.assertRules(loader.load_ruleset(self.filename))
+
+    def test_lazy(self):
+        ruleset = loader.load_ruleset(self.filename, lazy=True)
+        self.assertTrue(ruleset.lazy)
+        self.assertIsNone(ruleset[3]._regex)
+        self.assertRules(ruleset)
+
+    def test_write_cache(self):
+        self.assertRules(
+            loader.load_ruleset(self.filename, cache_dir=self.cache_dir),
+        )
+        self.assertTrue(os.path.exists(
+            loader.cache_filename(self.cache_dir, RULES),
+        ))
+
+    def test_read_cache(self):
+        loader.load_ruleset(self.filename, cache_dir=self.cache_dir)
+        with mock.patch.object(loader, 'parse_ruleset') as parse:
+            ruleset = loader.load_ruleset(
+                self.filename,
+                cache_dir=self.cache_dir,
+                cache_size=10,
+            )
+        parse.assert_not_called()
+        self.assertEqual(10, ruleset.cache_size)
+        self.assertRules(ruleset)
+
+    def test_bad_cache(self):
+        os.makedirs(self.cache_dir)
+        with open(loader.cache_filename(self.cache_dir, RULES), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertRules(
+            loader.load_ruleset(self.filename, cache_dir=self.cache_dir),
+        )
+
+    def test_changed_rules(self):
+        loader.load_ruleset(self.filename, cache_dir=self.cache_dir)
+        with open(self.filename, 'ab') as f:
+            f.write(b'redirect 301 /added /new/added\n')
+        ruleset = loader.load_ruleset(
+            self.filename, cache_dir=self.cache_dir,
+        )
+        self.assertEqual([2, 3, 4], ruleset.all_ids)
+
+    def test_cache_per_limits(self):
+        loader.load_ruleset(self.filename, cache_dir=self.cache_dir)
+        ruleset = loader.load_ruleset(
+            self.filename, cache_dir=self.cache_dir, match_limit=1000,
+        )
+        self.assertEqual((1000, 0), ruleset[3]._limits)
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+    def test_lint(self):
+        logger = self.useFixture(fixtures.FakeLogger())
+        with open(self.filename, 'ab') as f:
+            f.write(b'redirectmatch 301 ^/(a+)+$ /b\n')
+        loader.load_ruleset(self.filename, cache_dir=self.cache_dir)
+        loader.load_ruleset(self.filename, cache_dir=self.cache_dir)
+        self.assertEqual(
+            2,
+            logger.output.count('Nested quantifiers in (a+)+'),
+        )
+
+    def test_lazy_invalid_pattern_not_cached(self):
+        with open(self.filename, 'ab') as f:
+            f.write(b'redirectmatch 301 ^/x(/.*$ /y$1\n')
+        ruleset = loader.load_ruleset(
+            self.filename, cache_dir=self.cache_dir, lazy=True,
+        )
+        self.assertEqual([2, 3, 4], ruleset.all_ids)
+        self.assertFalse(os.path.exists(self.cache_dir))
+        self.assertRaises(
+            pcre2.PatternError,
+            loader.load_ruleset,
+            self.filename, cache_dir=self.cache_dir,
+        )
+
+    def test_lazy_cached(self):
+        loader.load_ruleset(
+            self.filename, cache_dir=self.cache_dir, lazy=True,
+        )
+        self.assertTrue(os.path.exists(
+            loader.cache_filename(self.cache_dir, RULES),
+        ))
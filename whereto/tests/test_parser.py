@@ -11,12 +11,64 @@
 # under the License.
 
 import io
+import shlex
 import textwrap
 
 from whereto import parser
 from whereto.tests import base
 
 
+class TestSplitLine(base.TestCase):
+
+    def test_plain(self):
+        self.assertEqual(
+            ['redirect', '/path', '/new/path'],
+            parser.split_line('redirect \t/path  /new/path '),
+        )
+
+    def test_empty(self):
+        self.assertEqual([], parser.split_line(''))
+
+    def test_double_quotes(self):
+        self.assertEqual(
+            ['a b', 'c"d\\e\\f'],
+            parser.split_line('"a b" "c\\"d\\\\e\\f"'),
+        )
+
+    def test_single_quotes(self):
+        self.assertEqual(
+            ['a b\\', ''],
+            parser.split_line("'a b\\' ''"),
+        )
+
+    def test_escapes(self):
+        self.assertEqual(
+            ['a b', '$1'],
+            parser.split_line('a\\ b \\$1'),
+        )
+
+    def test_adjacent_pieces(self):
+        self.assertEqual(
+            ['abcd'],
+            parser.split_line('a"b"\'c\'d'),
+        )
+
+    def test_same_as_shlex(self):
+        lines = [
+            'redirectmatch 301 "^/releases.*$" http://releases.org$1',
+            "a 'b \"c' \"d 'e\" #f",
+            'a\x0bb \xa0c',
+        ]
+        for line in lines:
+            self.assertEqual(shlex.split(line), parser.split_line(line))
+
+    def test_no_closing_quotation(self):
+        self.assertRaises(ValueError, parser.split_line, 'a "b')
+
+    def test_no_escaped_character(self):
+        self.assertRaises(ValueError, parser.split_line, 'a b\\')
+
+
 class TestParseRules(base.TestCase):
 
     def parse(self, text):
@@ -0,0 +1,118 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import pickle
+
+from whereto import profiler
+from whereto import rules
+from whereto.tests import base
+
+
+class TestRuleProfiler(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirectmatch', '301', '^/c/(.*)$', '/d/$1')
+        self.profiler = profiler.RuleProfiler()
+
+    def test_report(self):
+        self.profiler.record(1, '/a', 0.000001, True)
+        self.profiler.record(2, '/c/x', 0.000002, True)
+        self.profiler.record(2, '/c/y', 0.000004, False, error=True)
+        report = self.profiler.report(self.ruleset)
+        self.assertEqual(3, report['evaluations'])
+        self.assertEqual(7.0, report['total_us'])
+        self.assertEqual([2, 1], [r['linenum'] for r in report['rules']])
+        self.assertEqual(
+            {
+                'linenum': 2,
+                'rule': '[2] redirectmatch 301 ^/c/(.*)$ /d/$1',
+                'evaluations': 2,
+                'hits': 1,
+                'errors': 1,
+                'total_us': 6.0,
+                'avg_us': 3.0,
+                'max_us': 4.0,
+                'max_path': '/c/y',
+            },
+            report['rules'][0],
+        )
+
+    def test_top(self):
+        self.profiler.record(1, '/a', 0.000001, True)
+        self.profiler.record(2, '/c/x', 0.000002, True)
+        report = self.profiler.report(self.ruleset, top=1)
+        self.assertEqual([2], [r['linenum'] for r in report['rules']])
+        self.assertEqual(2, report['evaluations'])
+
+
+class TestRuleSetProfiling(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet(cache_size=10, lazy=True)
+        self.ruleset.add(1, 'redirectmatch', '301', '^/a/(.*)$', '/b/$1')
+        self.ruleset.add(2, 'redirectmatch', '301', '/c/(.*$', '/d/$1')
+        self.ruleset.add(3, 'redirect', '301', '/a/x', '/y')
+        self.ruleset.add(4, 'redirectmatch', '301', '/e/(.*)$', '/f/$1')
+        self.ruleset.profiler = profiler.RuleProfiler()
+
+    def _counts(self):
+        return {
+            linenum: (stats.evaluations, stats.hits, stats.errors)
+            for linenum, stats in self.ruleset.profiler.stats.items()
+        }
+
+    def test_every_candidate(self):
+        self.assertEqual(
+            (4, '301', '/x/f/y'),
+            self.ruleset.match('/x/e/y'),
+        )
+        self.assertEqual(
+            {2: (1, 0, 1), 4: (1, 1, 0)},
+            self._counts(),
+        )
+
+    def test_first_match_wins(self):
+        self.assertEqual(
+            (1, '301', '/b/x'),
+            self.ruleset.match('/a/x'),
+        )
+        self.assertEqual(
+            {1: (1, 1, 0)},
+            self._counts(),
+        )
+
+    def test_exact(self):
+        self.ruleset.add(5, 'redirect', '301', '/z', '/y')
+        self.assertEqual(
+            (5, '301', '/y'),
+            self.ruleset.match('/z'),
+        )
+        self.assertEqual(
+            {2: (1, 0, 1), 4: (1, 0, 0), 5: (1, 1, 0)},
+            self._counts(),
+        )
+
+    def test_no_cache(self):
+        self.ruleset.match('/x/e/y')
+        # match_many() still matches each distinct path once.
+        self.ruleset.match_many(['/x/e/y', '/x/e/y'])
+        self.assertEqual(0, self.ruleset.cache_hits)
+        self.assertEqual(2, self.ruleset.profiler.paths)
+        self.assertEqual(2, self._counts()[4][0])
+
+    def test_not_pickled(self):
+        copy = pickle.loads(pickle.dumps(self.ruleset))
+        self.assertIsNone(copy.profiler)
@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import time
+
+import fixtures
+
+from whereto import loader
+from whereto import reloader
+from whereto import server
+from whereto.tests import base
+
+
+class TestReloader(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.logger = self.useFixture(fixtures.FakeLogger())
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.filename = os.path.join(self.tmpdir, 'htaccess')
+        self._write('redirect 301 /a /b\n')
+        self.app = server.WSGIApplication(
+            loader.load_ruleset(self.filename))
+        self.reloader = reloader.Reloader(self.filename, self.app)
+
+    def _write(self, content):
+        with open(self.filename, 'w') as f:
+            f.write(content)
+        # Make sure the change is visible even on file systems with
+        # coarse timestamps.
+        now = time.time()
+        self.mtime = getattr(self, 'mtime', now) + 10
+        os.utime(self.filename, (self.mtime, self.mtime))
+
+    def test_unchanged(self):
+        old = self.app.ruleset
+        self.assertFalse(self.reloader.check())
+        self.assertIs(old, self.app.ruleset)
+
+    def test_changed(self):
+        self._write('redirect 301 /a /c\nredirect 301 /d /e\n')
+        self.assertTrue(self.reloader.check())
+        self.assertEqual((1, '301', '/c'), self.app.ruleset.match('/a'))
+        self.assertEqual(1, self.reloader.reloads)
+        # Only reloaded once for each change.
+        self.assertFalse(self.reloader.check())
+
+    def test_hits_follow_rules(self):
+        self._write('redirect 301 /a /b\nredirect 301 /c /d\n'
+                    'redirect 301 /e /f\n')
+        self.app.ruleset = loader.load_ruleset(self.filename)
+        self.reloader.hits = {1: 5, 2: 3, 3: 1}
+        self._write('redirect 301 /x /y\nredirect 301 /a /b\n'
+                    'redirect 301 /c /changed\nredirect 301 /e /f\n')
+        self.assertTrue(self.reloader.check())
+        # The rule for /c changed, so its count is dropped instead of
+        # being given to the rule now on line 2.
+        self.assertEqual({2: 5, 4: 1}, self.reloader.hits)
+        self.assertEqual(
+            ['/a', '/e'],
+            sorted(self.app.ruleset._hot_exact),
+        )
+        self._write('redirect 301 /a /b\nredirect 301 /e /f\n')
+        self.assertTrue(self.reloader.check())
+        self.assertEqual({1: 5, 2: 1}, self.reloader.hits)
+
+    def test_parse_error_keeps_old_rules(self):
+        old = self.app.ruleset
+        self._write('redirect 301 "/a /c\n')
+        self.assertFalse(self.reloader.check())
+        self.assertIs(old, self.app.ruleset)
+        self.assertEqual(1, self.reloader.failures)
+        self.assertIn('Keeping the old rules', self.logger.output)
+        self._write('redirect 301 /a /d\n')
+        self.assertTrue(self.reloader.check())
+        self.assertEqual((1, '301', '/d'), self.app.ruleset.match('/a'))
+
+    def test_bad_regex_keeps_old_rules(self):
+        old = self.app.ruleset
+        self._write('redirectmatch 301 ^/a(.*$ /c\n')
+        self.assertFalse(self.reloader.check())
+        self.assertIs(old, self.app.ruleset)
+
+    def test_missing_file_keeps_old_rules(self):
+        old = self.app.ruleset
+        os.unlink(self.filename)
+        self.assertFalse(self.reloader.check())
+        self.assertIs(old, self.app.ruleset)
+
+    def test_background_thread(self):
+        self.reloader.interval = 0.01
+        self.reloader.start()
+        self.addCleanup(self.reloader.stop)
+        self._write('redirect 301 /a /c\n')
+        for i in range(500):
+            if self.reloader.reloads:
+                break
+            time.sleep(0.01)
+        self.assertEqual((1, '301', '/c'), self.app.ruleset.match('/a'))
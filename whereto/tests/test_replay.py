@@ -0,0 +1,167 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import io
+import json
+import os
+from unittest import mock
+
+import fixtures
+
+from whereto import replay
+from whereto import rules
+from whereto.tests import base
+
+
+LOG_LINES = [
+    '127.0.0.1 - - [10/Oct/2026:13:55:36 +0000] '
+    '"GET /a?x=1 HTTP/1.1" 301 0 "-" "curl/8.0"\n',
+    '127.0.0.1 - - [10/Oct/2026:13:55:37 +0000] '
+    '"GET /d/page.html HTTP/1.1" 301 0\n',
+    '127.0.0.1 - - [10/Oct/2026:13:55:38 +0000] '
+    '"HEAD /a HTTP/1.0" 301 0\n',
+    '127.0.0.1 - - [10/Oct/2026:13:55:39 +0000] '
+    '"GET /missing HTTP/1.1" 404 0\n',
+    'garbage\n',
+]
+
+
+class TestRequestPath(base.TestCase):
+
+    def test_combined(self):
+        self.assertEqual('/a', replay.request_path(LOG_LINES[0]))
+
+    def test_http_1_0(self):
+        self.assertEqual('/a', replay.request_path(LOG_LINES[2]))
+
+    def test_plain_path(self):
+        self.assertEqual('/a/b', replay.request_path('/a/b 301 /c\n'))
+
+    def test_decoded(self):
+        self.assertEqual(
+            '/café x',
+            replay.request_path('"GET /caf%C3%A9%20x HTTP/1.1"'),
+        )
+
+    def test_absolute_url(self):
+        self.assertEqual(
+            '/a',
+            replay.request_path('"GET http://example.com/a?b HTTP/1.1"'),
+        )
+
+    def test_no_request(self):
+        self.assertIsNone(replay.request_path('garbage\n'))
+        self.assertIsNone(replay.request_path('"-" 400 0\n'))
+
+
+class TestReplay(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.ruleset = rules.RuleSet()
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirectmatch', '301', '^/d/(.*)$', '/e/$1')
+        self.ruleset.add(3, 'redirect', '410', '/gone')
+
+    def _write(self, name, lines, opener=open):
+        filename = os.path.join(self.tmpdir, name)
+        with opener(filename, 'wt') as f:
+            f.writelines(lines)
+        return filename
+
+    def test_counts(self):
+        filename = self._write('access.log', LOG_LINES)
+        counter, skipped = replay.replay(self.ruleset, [filename])
+        self.assertEqual(1, skipped)
+        report = counter.report()
+        self.assertEqual(4, report['requests'])
+        self.assertEqual(1, report['unmatched'])
+        self.assertEqual(0.25, report['unmatched_share'])
+        self.assertEqual(
+            [(1, 2), (2, 1), (3, 0)],
+            [(r['linenum'], r['hits']) for r in report['rules']],
+        )
+        self.assertIsNotNone(report['rules'][0]['avg_cost_us'])
+        self.assertIsNone(report['rules'][2]['avg_cost_us'])
+
+    def test_cost_per_rule(self):
+        ruleset = rules.RuleSet()
+        ruleset.add(1, 'redirectmatch', '301', '^/d/x', '/x')
+        ruleset.add(2, 'redirectmatch', '301', '^/d/(.*)$', '/e/$1')
+        counter, skipped = replay.replay(
+            ruleset, [self._write('access.log', LOG_LINES)])
+        report = counter.report()
+        # The first rule never matches, but it is evaluated before the
+        # second one and its own cost is reported.
+        self.assertEqual(
+            [0, 1],
+            [r['hits'] for r in report['rules']],
+        )
+        self.assertIsNotNone(report['rules'][0]['avg_cost_us'])
+        self.assertIsNotNone(report['rules'][1]['avg_cost_us'])
+        self.assertIsNone(ruleset.profiler)
+
+    def test_gzip_and_batches(self):
+        plain = self._write('access.log', LOG_LINES)
+        compressed = self._write('access.log.1.gz', LOG_LINES * 3,
+                                 opener=gzip.open)
+        counter, skipped = replay.replay(
+            self.ruleset, [plain, compressed], batch_size=2)
+        self.assertEqual(4, skipped)
+        self.assertEqual(16, counter.requests)
+        self.assertEqual(8, counter.hits[1])
+        self.assertEqual(4, counter.unmatched)
+
+    def test_files_closed(self):
+        plain = self._write('access.log', LOG_LINES)
+        compressed = self._write('access.log.1.gz', LOG_LINES,
+                                 opener=gzip.open)
+        opened = []
+
+        def fake_open(*args):
+            f = open(*args)
+            opened.append(f)
+            return f
+
+        with mock.patch('whereto.replay.open', fake_open, create=True):
+            replay.replay(self.ruleset, [plain, compressed])
+        self.assertEqual(2, len(opened))
+        self.assertTrue(all(f.closed for f in opened))
+
+    def test_stdin_left_open(self):
+        buffer = io.BufferedReader(io.BytesIO(
+            ''.join(LOG_LINES).encode('utf-8')))
+        stdin = io.TextIOWrapper(buffer)
+        with mock.patch('sys.stdin', stdin):
+            counter, skipped = replay.replay(self.ruleset, ['-'])
+        self.assertEqual(4, counter.requests)
+        self.assertFalse(buffer.closed)
+
+    def test_empty(self):
+        filename = self._write('access.log', [])
+        counter, skipped = replay.replay(self.ruleset, [filename])
+        report = counter.report()
+        self.assertEqual(0, report['requests'])
+        self.assertEqual(0.0, report['unmatched_share'])
+
+    def test_load_hit_counts(self):
+        counter, skipped = replay.replay(
+            self.ruleset, [self._write('access.log', LOG_LINES)])
+        filename = os.path.join(self.tmpdir, 'hits.json')
+        with open(filename, 'w') as f:
+            json.dump(counter.report(), f)
+        self.assertEqual(
+            {1: 2, 2: 1, 3: 0},
+            replay.load_hit_counts(filename),
+        )
@@ -10,6 +10,12 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import heapq
+import pickle
+from unittest import mock
+
+import pcre2
+
 from whereto import rules
 from whereto.tests import base
 
@@ -50,6 +56,34 @@ class TestRedirect(base.TestCase):
             str(self.rule),
         )
 
+    def test_str_implied_code(self):
+        rule = rules.Redirect(
+            1,
+            'Redirect', '/the/path', '/new/path',
+        )
+        self.assertEqual(
+            '[1] Redirect /the/path /new/path',
+            str(rule),
+        )
+
+    def test_str_410(self):
+        rule = rules.Redirect(
+            1,
+            'redirect', '410', '/the/path',
+        )
+        self.assertEqual(
+            '[1] redirect 410 /the/path',
+            str(rule),
+        )
+
+    def test_compact(self):
+        rule = rules.Redirect(
+            1,
+            'redirect', ''.join(['3', '01']), '/path', '/new/path',
+        )
+        self.assertFalse(hasattr(rule, '__dict__'))
+        self.assertIs(self.rule.code, rule.code)
+
     def test_too_few_args(self):
         self.assertRaises(
             ValueError,
@@ -81,6 +115,16 @@ class TestRedirect(base.TestCase):
             rule.match('/the/path'),
         )
 
+    def test_gone(self):
+        rule = rules.Redirect(
+            1,
+            'redirect', 'gone', '/the/path',
+        )
+        self.assertEqual(
+            ('gone', None),
+            rule.match('/the/path'),
+        )
+
 
 class TestRedirectMatch(base.TestCase):
 
@@ -204,6 +248,99 @@ class TestRedirectMatch(base.TestCase):
             rule.match('/the/path'),
         )
 
+    def test_match_with_multiple_groups(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/(.*)/user/(.*)$', '/$2/${1}x/$$',
+        )
+        self.assertEqual(
+            ('301', '/foo/pikex/$'),
+            rule.match('/pike/user/foo'),
+        )
+
+    def test_match_keeps_unmatched_suffix(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/user/', '/pike/user/',
+        )
+        self.assertEqual(
+            ('301', '/pike/user/foo'),
+            rule.match('/user/foo'),
+        )
+
+    def test_match_unanchored_repeated(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', 'user', 'pike',
+        )
+        self.assertEqual(
+            ('301', '/pike/pike'),
+            rule.match('/user/user'),
+        )
+
+    def test_target_parts(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/(.*)/user/(.*)$', '/$2/${1}\\$1$$',
+        )
+        self.assertEqual(
+            ['/', 2, '/', 1, '$', '1', '$'],
+            rule.target_parts,
+        )
+
+    def test_target_parts_unsupported(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/(?<name>.*)$', '/new/${name}',
+        )
+        self.assertIsNone(rule.target_parts)
+        self.assertEqual(
+            ('301', '/new/foo'),
+            rule.match('/foo'),
+        )
+
+    def test_prefix(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/nova/latest/(.*)$', '/nova/$1',
+        )
+        self.assertEqual('/nova/latest/', rule.prefix)
+
+    def test_prefix_escaped(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/nova\\.html\\/x', '/nova/',
+        )
+        self.assertEqual('/nova.html/x', rule.prefix)
+
+    def test_prefix_optional_char(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/nova/?$', '/nova/',
+        )
+        self.assertEqual('/nova', rule.prefix)
+
+    def test_prefix_unanchored(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '/nova/latest/(.*)$', '/nova/$1',
+        )
+        self.assertIsNone(rule.prefix)
+
+    def test_prefix_alternation(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^/nova/|^/cinder/', '/',
+        )
+        self.assertIsNone(rule.prefix)
+
+    def test_prefix_none(self):
+        rule = rules.RedirectMatch(
+            1,
+            'redirectmatch', '301', '^(.*)/index.html$', '$1/',
+        )
+        self.assertIsNone(rule.prefix)
+
 
 class TestRuleSet(base.TestCase):
 
@@ -262,3 +399,651 @@ class TestRuleSet(base.TestCase):
             (1, '301', '/new/path'),
             self.ruleset.match('/path'),
         )
+
+    def test_match_regex_before_redirect(self):
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '^/path$', '/regex/path',
+        )
+        self.ruleset.add(
+            2,
+            'redirect', '301', '/path', '/new/path',
+        )
+        self.assertEqual(
+            (1, '301', '/regex/path'),
+            self.ruleset.match('/path'),
+        )
+
+    def test_match_redirect_before_regex(self):
+        self.ruleset.add(
+            1,
+            'redirect', '301', '/path', '/new/path',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '301', '^/path$', '/regex/path',
+        )
+        self.assertEqual(
+            (1, '301', '/new/path'),
+            self.ruleset.match('/path'),
+        )
+
+    def test_match_none(self):
+        self.ruleset.add(
+            1,
+            'redirect', '301', '/path', '/new/path',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '301', '^/other$', '/regex/path',
+        )
+        self.assertIsNone(self.ruleset.match('/unknown'))
+
+    def test_match_regex_order(self):
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '/path/(.*)$', '/first/$1',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '301', '^/other/path/(.*)$', '/second/$1',
+        )
+        self.assertEqual(
+            (1, '301', '/other/first/foo'),
+            self.ruleset.match('/other/path/foo'),
+        )
+
+    def test_match_regex_uncombinable(self):
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '^/(a)/\\1$', '/first',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '301', '^/a/', '/second',
+        )
+        self.assertEqual(
+            (1, '301', '/first'),
+            self.ruleset.match('/a/a'),
+        )
+        self.assertEqual(
+            (2, '301', '/secondb'),
+            self.ruleset.match('/a/b'),
+        )
+
+    def test_match_regex_conditional(self):
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '^/q(x)?(?(1)y|z)$', '/first',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '301', '^/(a)?(?(-1)b|c)$', '/second',
+        )
+        self.ruleset.add(
+            3,
+            'redirectmatch', '301', '^/other/', '/third',
+        )
+        self.assertEqual(
+            (1, '301', '/first'),
+            self.ruleset.match('/qxy'),
+        )
+        self.assertEqual(
+            (1, '301', '/first'),
+            self.ruleset.match('/qz'),
+        )
+        self.assertEqual(
+            (2, '301', '/second'),
+            self.ruleset.match('/ab'),
+        )
+        self.assertEqual(
+            (2, '301', '/second'),
+            self.ruleset.match('/c'),
+        )
+        self.assertIsNone(self.ruleset.match('/qy'))
+
+    def test_match_prefix_order(self):
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '^/nova/(.*)$', '/first/$1',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '301', '^.*/latest/(.*)$', '/second/$1',
+        )
+        self.ruleset.add(
+            3,
+            'redirectmatch', '301', '^/nova/latest/(.*)$', '/third/$1',
+        )
+        self.assertEqual(
+            (1, '301', '/first/latest/foo'),
+            self.ruleset.match('/nova/latest/foo'),
+        )
+        self.assertEqual(
+            (2, '301', '/second/foo'),
+            self.ruleset.match('/cinder/latest/foo'),
+        )
+
+    def test_match_prefix_skipped(self):
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '^/nova/latest/(.*)$', '/first/$1',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '301', '^/nova/(.*)$', '/second/$1',
+        )
+        self.assertEqual(
+            (2, '301', '/second/pike/foo'),
+            self.ruleset.match('/nova/pike/foo'),
+        )
+
+
+class TestPrefixTrie(base.TestCase):
+
+    def entry(self, position, pattern):
+        rule = rules.RedirectMatch(
+            position + 1, 'redirectmatch', pattern, '/new',
+        )
+        return (position, rule)
+
+    def candidates(self, trie, path):
+        return list(heapq.merge(*trie.candidates(path, 100)))
+
+    def test_candidates(self):
+        trie = rules.PrefixTrie()
+        nova = self.entry(0, '^/nova/latest/')
+        cinder = self.entry(1, '^/cinder/')
+        short = self.entry(2, '^/n')
+        for entry in (nova, cinder, short):
+            trie.add(entry)
+        self.assertEqual(
+            [nova, short],
+            self.candidates(trie, '/nova/latest/foo'),
+        )
+        self.assertEqual(
+            [short],
+            self.candidates(trie, '/nova/pike/foo'),
+        )
+        self.assertEqual(
+            [],
+            self.candidates(trie, 'glance/foo'),
+        )
+        self.assertEqual(
+            [cinder, short],
+            self.candidates(trie, '/cinder/foo'),
+        )
+
+    def test_compile(self):
+        trie = rules.PrefixTrie()
+        nova = self.entry(0, '^/nova/latest/')
+        trie.add(nova)
+        trie.compile()
+        node = trie._children['']._children['nova']._children['latest']
+        self.assertIsInstance(node._engine, rules.RegexEngine)
+        self.assertIsNone(trie._engine)
+        self.assertEqual([nova], self.candidates(trie, '/nova/latest/foo'))
+
+
+class TestPatternSet(base.TestCase):
+
+    def entries(self, *patterns):
+        return [
+            (n, rules.RedirectMatch(n + 1, 'redirectmatch', p, '/new'))
+            for n, p in enumerate(patterns)
+        ]
+
+    def test_search_first(self):
+        patterns = rules.PatternSet(
+            self.entries('^/a$', '^/b', 'b', '(?i)B$'),
+        )
+        self.assertEqual(1, patterns.search('/b'))
+        self.assertEqual(2, patterns.search('/ab'))
+        self.assertEqual(3, patterns.search('/AB'))
+        self.assertEqual(0, patterns.search('/a'))
+
+    def test_search_no_match(self):
+        patterns = rules.PatternSet(
+            self.entries('^/a$', '^/b'),
+        )
+        self.assertIsNone(patterns.search('/c'))
+
+    def test_search_anchored_alternation(self):
+        patterns = rules.PatternSet(
+            self.entries('^/a$', '^/b|c$'),
+        )
+        self.assertEqual(1, patterns.search('/abc'))
+
+
+class TestRegexEngine(base.TestCase):
+
+    def entries(self, *patterns):
+        return [
+            (n, rules.RedirectMatch(n + 1, 'redirectmatch', p, '/new'))
+            for n, p in enumerate(patterns)
+        ]
+
+    def test_uncombinable_segment(self):
+        entries = self.entries('^/a', '^/(b)\\1', '^/c', '^/d')
+        engine = rules.RegexEngine(entries)
+        self.assertEqual(
+            [entries[0], entries[1], entries[3]],
+            list(engine.candidates('/d', 4)),
+        )
+
+    def test_candidates_limit(self):
+        entries = self.entries('^/a', '^/b', '^/c')
+        engine = rules.RegexEngine(entries)
+        self.assertEqual(
+            [],
+            list(engine.candidates('/c', 2)),
+        )
+        self.assertEqual(
+            [entries[2]],
+            list(engine.candidates('/c', 3)),
+        )
+
+
+class TestRuleSetCache(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet(cache_size=2)
+        self.ruleset.add(
+            1,
+            'redirect', '301', '/path', '/new/path',
+        )
+
+    def test_hit(self):
+        self.ruleset.match('/path')
+        self.assertEqual(
+            (1, '301', '/new/path'),
+            self.ruleset.match('/path'),
+        )
+        self.assertEqual(1, self.ruleset.cache_hits)
+        self.assertEqual(1, self.ruleset.cache_misses)
+
+    def test_miss_cached(self):
+        self.ruleset.match('/other')
+        self.assertIsNone(self.ruleset.match('/other'))
+        self.assertEqual(1, self.ruleset.cache_hits)
+
+    def test_evict_least_recently_used(self):
+        self.ruleset.match('/a')
+        self.ruleset.match('/b')
+        self.ruleset.match('/a')
+        self.ruleset.match('/c')
+        self.assertEqual(['/a', '/c'], list(self.ruleset._cache))
+
+    def test_add_invalidates(self):
+        self.ruleset.match('/other')
+        self.ruleset.add(
+            2,
+            'redirect', '301', '/other', '/new/other',
+        )
+        self.assertEqual(
+            (2, '301', '/new/other'),
+            self.ruleset.match('/other'),
+        )
+        self.assertEqual(0, self.ruleset.cache_hits)
+
+
+class TestRuleSetMatchMany(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+        self.ruleset.add(
+            1,
+            'redirect', '301', '/path', '/new/path',
+        )
+        self.ruleset.add(
+            2,
+            'redirectmatch', '302', '^/regex/(.*)$', '/new/regex/$1',
+        )
+
+    def test_results_in_order(self):
+        paths = ['/regex/a', '/other', '/path', '/regex/b']
+        self.assertEqual(
+            [self.ruleset.match(p) for p in paths],
+            self.ruleset.match_many(iter(paths)),
+        )
+
+    def test_repeated_paths_matched_once(self):
+        with mock.patch.object(self.ruleset, '_match',
+                               wraps=self.ruleset._match) as m:
+            results = self.ruleset.match_many(['/path', '/x', '/path'])
+        self.assertEqual(
+            [(1, '301', '/new/path'), None, (1, '301', '/new/path')],
+            results,
+        )
+        self.assertEqual(2, m.call_count)
+
+    def test_cache(self):
+        self.ruleset.cache_size = 10
+        self.ruleset.match_many(['/path', '/path'])
+        self.ruleset.match_many(['/path'])
+        self.assertEqual(1, self.ruleset.cache_misses)
+        self.assertEqual(1, self.ruleset.cache_hits)
+
+    def test_trace(self):
+        self.ruleset.trace = []
+        self.ruleset.match_many(['/path', '/other', '/path'])
+        self.assertEqual(
+            [(1, '/path', ('301', '/new/path')),
+             (None, '/other', None),
+             (1, '/path', ('301', '/new/path'))],
+            self.ruleset.trace,
+        )
+
+
+class TestRuleSetOptimize(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '^/nova/(.*)$', '/compute/$1',
+        )
+        self.ruleset.add(
+            2,
+            'redirect', '301', '/nova/old', '/never',
+        )
+        self.ruleset.add(
+            3,
+            'redirect', '301', '/cinder/old', '/cinder/new',
+        )
+        self.ruleset.add(
+            4,
+            'redirectmatch', '301', '^/glance/(.*)$', '/image/$1',
+        )
+        self.ruleset.add(
+            5,
+            'redirectmatch', '301', '^/glance/v1/(.*)$', '/image/v1/$1',
+        )
+        self.ruleset.add(
+            6,
+            'redirectmatch', '301', '^/swift/(.*)$', '/object/$1',
+        )
+        self.ruleset.add(
+            7,
+            'redirectmatch', '301', 'old$', '/old',
+        )
+        self.ruleset.add(
+            8,
+            'redirectmatch', '301', '^/keystone/(.*)$', '/identity/$1',
+        )
+
+    def test_plan(self):
+        self.ruleset.optimize({n: 1 for n in self.ruleset.all_ids})
+        # Rule 2 is shadowed by rule 1.
+        self.assertEqual(['/cinder/old'], list(self.ruleset._hot_exact))
+        # Rule 5 overlaps rule 4, and rule 8 comes after rule 7, which
+        # could match anything.
+        self.assertEqual(
+            {'/nova/': 1, '/glance/': 4, '/swift/': 6},
+            {p: r.linenum for p, r in self.ruleset._hot_patterns.items()},
+        )
+
+    def test_unused_rules_not_in_plan(self):
+        self.ruleset.optimize({3: 10, 6: 0})
+        self.assertEqual(['/cinder/old'], list(self.ruleset._hot_exact))
+        self.assertEqual({}, self.ruleset._hot_patterns)
+
+    def test_max_patterns(self):
+        self.ruleset.optimize({1: 1, 4: 3, 6: 2}, max_patterns=2)
+        self.assertEqual(
+            ['/glance/', '/swift/'],
+            sorted(self.ruleset._hot_patterns),
+        )
+
+    def test_same_results(self):
+        paths = [
+            '/nova/old', '/nova/x', '/cinder/old', '/glance/v1/x',
+            '/glance/x', '/swift/x', '/keystone/x', '/keystone/old',
+            '/other', '/cinder/old/',
+        ]
+        expected = [self.ruleset.match(p) for p in paths]
+        self.ruleset.optimize({n: 1 for n in self.ruleset.all_ids})
+        self.assertEqual(expected, [self.ruleset.match(p) for p in paths])
+
+    def test_add_drops_plan(self):
+        self.ruleset.optimize({n: 1 for n in self.ruleset.all_ids})
+        self.ruleset.add(
+            9,
+            'redirect', '301', '/a', '/b',
+        )
+        self.assertEqual({}, self.ruleset._hot_exact)
+        self.assertEqual({}, self.ruleset._hot_patterns)
+
+
+class TestRuleSetTrace(base.TestCase):
+
+    def test_trace(self):
+        trace = []
+        ruleset = rules.RuleSet(trace=trace)
+        ruleset.add(
+            1,
+            'redirect', '301', '/path', '/new/path',
+        )
+        ruleset.match('/path')
+        ruleset.match('/other')
+        self.assertEqual(
+            [(1, '/path', ('301', '/new/path')),
+             (None, '/other', None)],
+            trace,
+        )
+
+
+class TestRuleSetLazy(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet(lazy=True)
+        self.ruleset.add(
+            1,
+            'redirectmatch', '301', '^/a/(.*)$', '/b/$1',
+        )
+        self.ruleset.add(
+            2,
+            'redirect', '301', '/c', '/d',
+        )
+        self.ruleset.add(
+            3,
+            'redirectmatch', '301', '^/e/(.*$', '/f/$1',
+        )
+        self.ruleset.add(
+            4,
+            'redirectmatch', '301', '/g/(.*)$', '/h/$1',
+        )
+
+    def test_invalid_pattern_eager(self):
+        self.assertRaises(
+            pcre2.PatternError,
+            rules.RedirectMatch,
+            1, 'redirectmatch', '301', '^/e/(.*$', '/f/$1',
+        )
+
+    def test_compiled_on_first_match(self):
+        self.assertIsNone(self.ruleset[1]._regex)
+        self.assertIsNone(self.ruleset[4]._regex)
+        self.assertEqual(
+            (1, '301', '/b/x'),
+            self.ruleset.match('/a/x'),
+        )
+        self.assertIsNotNone(self.ruleset[1]._regex)
+        self.assertEqual(['/b/', 1], self.ruleset[1].target_parts)
+        self.assertIsNone(self.ruleset[4]._regex)
+
+    def test_invalid_pattern(self):
+        self.assertIsNone(self.ruleset.match('/e/x'))
+
+    def test_precompile(self):
+        stats = self.ruleset.precompile()
+        self.assertEqual(2, stats['compiled'])
+        self.assertEqual(0, stats['already_compiled'])
+        self.assertEqual([3], [linenum for linenum, msg in stats['errors']])
+        stats = self.ruleset.precompile()
+        self.assertEqual(0, stats['compiled'])
+        self.assertEqual(2, stats['already_compiled'])
+
+    def test_precompile_subset(self):
+        stats = self.ruleset.precompile([2, 4, 99])
+        self.assertEqual(1, stats['compiled'])
+        self.assertEqual([], stats['errors'])
+        self.assertIsNone(self.ruleset[1]._regex)
+        self.assertIsNotNone(self.ruleset[4]._regex)
+
+    def test_precompile_workers(self):
+        self.ruleset.precompile_chunk_size = 1
+        stats = self.ruleset.precompile(workers=2)
+        self.assertEqual(2, stats['compiled'])
+        self.assertEqual(1, len(stats['errors']))
+        self.assertEqual(
+            (4, '301', '/x/h/y'),
+            self.ruleset.match('/x/g/y'),
+        )
+
+
+class TestRuleSetJIT(base.TestCase):
+
+    def _ruleset(self, **kwargs):
+        ruleset = rules.RuleSet(**kwargs)
+        ruleset.add(
+            1,
+            'redirectmatch', '301', '/a/(.*)$', '/b/$1',
+        )
+        ruleset.add(
+            2,
+            'redirectmatch', '301', '/c/(.*)$', '/d/$1',
+        )
+        return ruleset
+
+    def test_default(self):
+        ruleset = self._ruleset()
+        ruleset.compile()
+        self.assertTrue(ruleset[1].regex.jit)
+        self.assertTrue(ruleset._engine._segments[0].regex.jit)
+
+    def test_disabled(self):
+        ruleset = self._ruleset(jit=False)
+        ruleset.compile()
+        self.assertFalse(ruleset[1].regex.jit)
+        self.assertFalse(ruleset._engine._segments[0].regex.jit)
+        self.assertEqual(
+            (2, '301', '/x/d/y'),
+            ruleset.match('/x/c/y'),
+        )
+
+    def test_fallback(self):
+        with mock.patch.object(pcre2.Pattern, 'jit_compile') as jit_compile:
+            jit_compile.side_effect = pcre2.LibraryError(-45)
+            ruleset = self._ruleset()
+            ruleset.compile()
+        self.assertFalse(ruleset[1].regex.jit)
+        # The combined pattern is still used.
+        self.assertEqual(1, len(ruleset._engine._segments))
+        self.assertEqual(
+            (2, '301', '/x/d/y'),
+            ruleset.match('/x/c/y'),
+        )
+
+
+class TestRuleSetLimits(base.TestCase):
+
+    # Backtracks exponentially on a run of a's that is not followed by
+    # the end of the path.
+    slow = '^/(?:a|(?:a)+)+$'
+
+    def test_limit_verbs(self):
+        self.assertEqual('', rules.limit_verbs())
+        self.assertEqual(
+            '(*LIMIT_MATCH=100)(*LIMIT_DEPTH=10)',
+            rules.limit_verbs(100, 10),
+        )
+
+    def test_exceeded(self):
+        ruleset = rules.RuleSet(match_limit=1000)
+        ruleset.add(1, 'redirectmatch', '301', self.slow, '/b')
+        ruleset.add(2, 'redirectmatch', '301', '^/(a+)x$', '/c')
+        ruleset.add(3, 'redirectmatch', '301', '/a/$', '/d/')
+        ruleset.add(4, 'redirectmatch', '301', '^/a', '/e')
+        self.assertEqual(
+            (4, '301', '/e' + 'a' * 29 + 'b'),
+            ruleset.match('/' + 'a' * 30 + 'b'),
+        )
+        self.assertEqual({1: 1}, dict(ruleset.limit_errors))
+
+    def test_combined_limit(self):
+        ruleset = rules.RuleSet(match_limit=1000)
+        ruleset.add(1, 'redirectmatch', '301', '/a/(.*)$', '/b/$1')
+        ruleset.add(2, 'redirectmatch', '301', '/c/(.*)$', '/d/$1')
+        ruleset.compile()
+        self.assertTrue(ruleset[1].regex.pattern.startswith(
+            '(*LIMIT_MATCH=1000)/a/'))
+        self.assertTrue(ruleset._engine._segments[0].regex.pattern.startswith(
+            '(*LIMIT_MATCH=2000)(?n)'))
+
+    def test_error_position(self):
+        def error(**kwargs):
+            try:
+                rules.RuleSet(**kwargs).add(
+                    1, 'redirectmatch', '301', '^/(a', '/b')
+            except Exception as e:
+                return str(e)
+        self.assertEqual(error(), error(match_limit=1000, depth_limit=10))
+
+    def test_exceeded_limit(self):
+        self.assertTrue(rules.exceeded_limit(
+            pcre2.LibraryError(-47)))
+        self.assertFalse(rules.exceeded_limit(
+            pcre2.LibraryError(-45)))
+        self.assertFalse(rules.exceeded_limit(
+            ValueError('match limit exceeded')))
+
+
+class TestRuleSetPickle(base.TestCase):
+
+    def test_rule_round_trip(self):
+        rule = rules.RedirectMatch(
+            3,
+            'RedirectMatch', '^/a/(.*)$', '/b/$1',
+        )
+        rule.match('/a/x')
+        copy = pickle.loads(pickle.dumps(rule))
+        self.assertIsNone(copy._regex)
+        self.assertEqual(str(rule), str(copy))
+        self.assertEqual('/a/', copy.prefix)
+        self.assertEqual(('301', '/b/x'), copy.match('/a/x'))
+
+    def test_round_trip(self):
+        ruleset = rules.RuleSet(cache_size=10)
+        ruleset.add(
+            1,
+            'redirect', '301', '/path', '/new/path',
+        )
+        ruleset.add(
+            2,
+            'redirectmatch', '301', '^/regex/(.*)$', '/new/regex/$1',
+        )
+        ruleset.add(
+            3,
+            'redirectmatch', '301', '/other/(.*)$', '/new/other/$1',
+        )
+        ruleset.match('/path')
+        copy = pickle.loads(pickle.dumps(ruleset))
+        self.assertIsNone(copy[2]._regex)
+        self.assertEqual(0, copy.cache_hits)
+        self.assertEqual(
+            (2, '301', '/new/regex/foo'),
+            copy.match('/regex/foo'),
+        )
+        self.assertEqual(
+            (3, '301', '/x/new/other/foo'),
+            copy.match('/x/other/foo'),
+        )
+        self.assertEqual(
+            (1, '301', '/new/path'),
+            copy.match('/path'),
+        )
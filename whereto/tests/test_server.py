@@ -0,0 +1,210 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+
+from whereto import rules
+from whereto import server
+from whereto.tests import base
+
+
+class TestWSGIApplication(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirectmatch', '302', '^/c/(.*)$', '/d/$1')
+        self.ruleset.add(3, 'redirect', '410', '/gone', None)
+        self.ruleset.add(4, 'redirect', '301', '/e', '/f?x=1')
+        self.app = server.WSGIApplication(self.ruleset)
+
+    def _get(self, path, query='', script_name=''):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': script_name,
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': query,
+        }
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        response['body'] = b''.join(self.app(environ, start_response))
+        return response
+
+    def test_redirect(self):
+        response = self._get('/a')
+        self.assertEqual('301 Moved Permanently', response['status'])
+        self.assertEqual('/b', response['headers']['Location'])
+
+    def test_redirectmatch(self):
+        response = self._get('/c/page.html')
+        self.assertEqual('302 Found', response['status'])
+        self.assertEqual('/d/page.html', response['headers']['Location'])
+
+    def test_gone(self):
+        response = self._get('/gone')
+        self.assertEqual('410 Gone', response['status'])
+        self.assertNotIn('Location', response['headers'])
+
+    def test_not_found(self):
+        response = self._get('/nothing')
+        self.assertEqual('404 Not Found', response['status'])
+        self.assertNotIn('Location', response['headers'])
+        self.assertEqual(b'404 Not Found\n', response['body'])
+        self.assertEqual(
+            str(len(response['body'])),
+            response['headers']['Content-Length'],
+        )
+
+    def test_query_string(self):
+        response = self._get('/a', query='q=1')
+        self.assertEqual('/b?q=1', response['headers']['Location'])
+
+    def test_query_string_in_target(self):
+        response = self._get('/e', query='q=1')
+        self.assertEqual('/f?x=1', response['headers']['Location'])
+
+    def test_script_name(self):
+        response = self._get('/page.html', script_name='/c')
+        self.assertEqual('/d/page.html', response['headers']['Location'])
+
+    def test_utf8_path(self):
+        self.ruleset.add(5, 'redirect', '301', '/café', '/cafe')
+        response = self._get('/café')
+        self.assertEqual('/cafe', response['headers']['Location'])
+
+    def test_utf8_target(self):
+        response = self._get('/c/\u20ac caf\u00e9')
+        self.assertEqual(
+            '/d/%E2%82%AC%20caf%C3%A9',
+            response['headers']['Location'],
+        )
+
+    def test_encoded_target_unchanged(self):
+        self.ruleset.add(5, 'redirect', '301', '/g', '/h%20i?j=k&l')
+        response = self._get('/g')
+        self.assertEqual('/h%20i?j=k&l', response['headers']['Location'])
+
+    def test_status_keywords(self):
+        self.ruleset.add(5, 'redirect', 'permanent', '/p', '/q')
+        self.ruleset.add(6, 'redirect', 'temp', '/t', '/q')
+        self.ruleset.add(7, 'redirect', 'seeother', '/s', '/q')
+        self.ruleset.add(8, 'redirect', 'gone', '/g')
+        for path, status in [('/p', '301 Moved Permanently'),
+                             ('/t', '302 Found'),
+                             ('/s', '303 See Other')]:
+            response = self._get(path)
+            self.assertEqual(status, response['status'])
+            self.assertEqual('/q', response['headers']['Location'])
+        response = self._get('/g')
+        self.assertEqual('410 Gone', response['status'])
+        self.assertNotIn('Location', response['headers'])
+
+    def test_invalid_code(self):
+        self.ruleset.add(5, 'redirect', 'sometimes', '/p', '/q')
+        response = self._get('/p')
+        self.assertEqual('500 Internal Server Error', response['status'])
+        self.assertNotIn('Location', response['headers'])
+
+    def test_replace_ruleset(self):
+        ruleset = rules.RuleSet()
+        ruleset.add(1, 'redirect', '301', '/a', '/z')
+        self.app.ruleset = ruleset
+        response = self._get('/a')
+        self.assertEqual('/z', response['headers']['Location'])
+
+
+class TestASGIApplication(base.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ruleset = rules.RuleSet()
+        self.ruleset.add(1, 'redirect', '301', '/a', '/b')
+        self.ruleset.add(2, 'redirect', '410', '/gone', None)
+        self.app = server.ASGIApplication(self.ruleset)
+
+    def _call(self, scope, messages=()):
+        received = list(messages)
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.app(scope, receive, send))
+        return sent
+
+    def _get(self, path, query=b'', root_path=''):
+        start, body = self._call({
+            'type': 'http',
+            'method': 'GET',
+            'path': path,
+            'root_path': root_path,
+            'query_string': query,
+        })
+        self.assertEqual('http.response.start', start['type'])
+        self.assertEqual('http.response.body', body['type'])
+        return start['status'], dict(start['headers']), body['body']
+
+    def test_redirect(self):
+        status, headers, body = self._get('/a', b'q=1')
+        self.assertEqual(301, status)
+        self.assertEqual(b'/b?q=1', headers[b'location'])
+
+    def test_utf8_target(self):
+        self.ruleset.add(3, 'redirectmatch', '301', '^/c/(.*)$', '/d/$1')
+        status, headers, body = self._get('/c/\u20ac')
+        self.assertEqual(b'/d/%E2%82%AC', headers[b'location'])
+
+    def test_root_path(self):
+        self.ruleset.add(3, 'redirect', '301', '/c/page.html', '/d')
+        status, headers, body = self._get('/page.html', root_path='/c')
+        self.assertEqual(b'/d', headers[b'location'])
+
+    def test_root_path_in_path(self):
+        self.ruleset.add(3, 'redirect', '301', '/c/page.html', '/d')
+        status, headers, body = self._get('/c/page.html', root_path='/c')
+        self.assertEqual(b'/d', headers[b'location'])
+
+    def test_gone(self):
+        status, headers, body = self._get('/gone')
+        self.assertEqual(410, status)
+        self.assertNotIn(b'location', headers)
+
+    def test_not_found(self):
+        status, headers, body = self._get('/nothing')
+        self.assertEqual(404, status)
+        self.assertEqual(b'404 Not Found\n', body)
+
+    def test_lifespan(self):
+        sent = self._call(
+            {'type': 'lifespan'},
+            [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}],
+        )
+        self.assertEqual(
+            [{'type': 'lifespan.startup.complete'},
+             {'type': 'lifespan.shutdown.complete'}],
+            sent,
+        )
+
+    def test_unsupported_scope(self):
+        self.assertRaises(
+            ValueError,
+            self._call,
+            {'type': 'websocket'},
+        )